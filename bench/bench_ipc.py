@@ -0,0 +1,259 @@
+# Copyright 2009-2014 Lee Harr
+#
+# This file is part of pybotwar.
+#     http://pybotwar.googlecode.com/
+#
+# Pybotwar is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pybotwar is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Pybotwar.  If not, see <http://www.gnu.org/licenses/>.
+
+
+'''Measure how long the game takes to talk to the robots.
+
+Runs Game.tick against real robot processes (control.py) running a
+    trivial robot, so nearly all of the time is spent passing the
+    sensors and commands through the pipes. For each number of
+    robots it reports:
+
+    tick latency -- p50, p90, p99 and max time for one Game.tick
+    syscalls -- read and write calls per tick, in the game process
+        and in all of the robot processes together (from
+        /proc/<pid>/io, so Linux only)
+    timeouts -- how many replies came back as TIMEOUT
+
+Results are printed as JSON:
+
+    python bench/bench_ipc.py
+    python bench/bench_ipc.py -r 2 10 --protocol binary --concurrent
+
+'''
+
+
+import os
+import sys
+import time
+import json
+import platform
+from argparse import ArgumentParser
+
+top = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, top)
+cwd = os.getcwd()
+os.chdir(top) # robot directories are relative to here
+
+try:
+    import conf
+except ImportError:
+    # No conf.py here, so use the defaults
+    import defaults as conf
+    sys.modules['conf'] = conf
+
+import viewselect
+viewselect.select_view_module('none')
+
+import logging
+logging.getLogger('PybotwarLogger').setLevel(logging.WARNING)
+
+from game import Game
+
+
+nrobots = [2, 5, 10, 25, 50]
+
+
+class BenchGame(Game):
+    'Game that counts every TIMEOUT reply.'
+
+    def __init__(self, *args, **kw):
+        Game.__init__(self, *args, **kw)
+        self.timeout_count = 0
+
+    def tick_result(self, robotname, model, result, plan):
+        if result == 'TIMEOUT':
+            self.timeout_count += 1
+        Game.tick_result(self, robotname, model, result, plan)
+
+
+def syscalls(pid='self'):
+    '''Return the number of read and write calls made so far by the
+        process, or None if that cannot be found out.
+    '''
+
+    try:
+        f = open('/proc/%s/io' % pid)
+        lines = f.readlines()
+        f.close()
+    except (IOError, OSError):
+        return None
+
+    counts = {}
+    for line in lines:
+        name, _, value = line.partition(':')
+        counts[name] = int(value)
+    return counts['syscr'] + counts['syscw']
+
+def robot_syscalls(game):
+    'Return the total syscalls() of all the robot processes.'
+
+    total = 0
+    for proc in game.procs.values():
+        pid = getattr(proc, 'pid', None)
+        if pid is None:
+            # robot is running in the game process
+            continue
+        n = syscalls(pid)
+        if n is None:
+            return None
+        total += n
+    return total
+
+def percentile(values, p):
+    'Return the value at percentile p of the sorted list of values.'
+
+    i = int(round(p / 100.0 * (len(values) - 1)))
+    return values[i]
+
+
+def bench(robot, n, ticks):
+    '''Run a battle between n copies of the robot for the given
+        number of ticks.
+
+    Returns a dictionary with the timings.
+
+    '''
+
+    conf.robots = [robot] * n
+    game = BenchGame(seed=1)
+    game.load_robots()
+    started = len(game.procs)
+
+    game_sys0 = syscalls()
+    robot_sys0 = robot_syscalls(game)
+
+    latencies = []
+    t0 = time.time()
+    for rnd in range(ticks):
+        ts = time.time()
+        game.tick(False)
+        latencies.append(time.time() - ts)
+    elapsed = time.time() - t0
+
+    game_sys1 = syscalls()
+    robot_sys1 = robot_syscalls(game)
+    remaining = len(game.procs)
+
+    game.finish(False)
+
+    if game_sys0 is None:
+        game_per_tick = None
+    else:
+        game_per_tick = round((game_sys1 - game_sys0) / float(ticks), 2)
+    if robot_sys0 is None or robot_sys1 is None or remaining != started:
+        # Cannot compare if any robots went away
+        robot_per_tick = None
+    else:
+        robot_per_tick = round((robot_sys1 - robot_sys0) / float(ticks), 2)
+
+    latencies.sort()
+    ms = lambda seconds: round(1000 * seconds, 3)
+
+    return dict(
+        robots=n,
+        started=started,
+        remaining=remaining,
+        ticks=ticks,
+        seconds=round(elapsed, 4),
+        ticks_per_second=round(ticks / elapsed, 1),
+        p50_ms=ms(percentile(latencies, 50)),
+        p90_ms=ms(percentile(latencies, 90)),
+        p99_ms=ms(percentile(latencies, 99)),
+        max_ms=ms(latencies[-1]),
+        game_syscalls_per_tick=game_per_tick,
+        robot_syscalls_per_tick=robot_per_tick,
+        timeouts=game.timeout_count,
+        )
+
+
+def main():
+    parser = ArgumentParser(description='Benchmark the game/robot pipes.')
+    parser.add_argument('-r', '--robots', dest='robots',
+                    action='store', type=int, nargs='+', default=nrobots,
+                    help='numbers of robots to try')
+    parser.add_argument('-t', '--ticks', dest='ticks',
+                    action='store', type=int, default=600,
+                    help='ticks to run for each case (60 ticks = 1 second)')
+    parser.add_argument('--robot', dest='robot',
+                    action='store', default='template',
+                    help='robot module to run (default: template)')
+    parser.add_argument('--protocol', dest='protocol',
+                    action='store', choices=['text', 'binary'],
+                    default=conf.wire_protocol,
+                    help='wire protocol to use')
+    parser.add_argument('--concurrent', dest='concurrent',
+                    action='store_true', default=conf.concurrent_ticks,
+                    help='send to all robots before reading any replies')
+    parser.add_argument('--batch', dest='batch',
+                    action='store', type=int, default=conf.batch_ticks,
+                    help='ticks of commands robots may send at once')
+    parser.add_argument('--python', dest='python',
+                    action='store', default=conf.subproc_python,
+                    help='python to run the robot processes with')
+    parser.add_argument('-o', '--output', dest='output',
+                    action='store', default=None,
+                    help='write the JSON results to this file')
+    options = parser.parse_args()
+
+    conf.wire_protocol = options.protocol
+    conf.concurrent_ticks = options.concurrent
+    conf.batch_ticks = options.batch
+    conf.subproc_python = options.python
+    # Always use separate processes and start them fresh
+    conf.inprocess = False
+    conf.inprocess_robots = []
+    conf.record_replays = False
+
+    # The game prints as it goes. Keep stdout for the results.
+    stdout = sys.stdout
+    sys.stdout = sys.stderr
+
+    results = []
+    try:
+        for n in options.robots:
+            r = bench(options.robot, n, options.ticks)
+            sys.stderr.write(
+                '%3s robots: p50 %.3f ms  p99 %.3f ms  %s timeouts\n' % (
+                    n, r['p50_ms'], r['p99_ms'], r['timeouts']))
+            results.append(r)
+    finally:
+        sys.stdout = stdout
+
+    report = dict(
+        python=platform.python_version(),
+        platform=platform.platform(),
+        robot=options.robot,
+        protocol=options.protocol,
+        concurrent=options.concurrent,
+        batch=options.batch,
+        results=results,
+        )
+
+    out = json.dumps(report, indent=2, sort_keys=True)
+    if options.output is None:
+        print out
+    else:
+        f = open(os.path.join(cwd, options.output), 'w')
+        f.write(out)
+        f.write('\n')
+        f.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,207 @@
+# Copyright 2009-2014 Lee Harr
+#
+# This file is part of pybotwar.
+#     http://pybotwar.googlecode.com/
+#
+# Pybotwar is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pybotwar is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Pybotwar.  If not, see <http://www.gnu.org/licenses/>.
+
+
+'''Measure how fast the simulation runs.
+
+The robots here are scripted: their commands are made up by the
+    benchmark and handed straight to Game.apply_commands, so no robot
+    processes are started and the time measured is (almost) all
+    spent in the world. Nothing is drawn (the noview module is used).
+
+Scenarios:
+    move -- robots drive and turn their turrets
+    bullets -- robots also fire each time the cannon reloads
+    pings -- robots also ping every tick
+
+Results are printed as JSON. Run from the top pybotwar directory,
+    or from anywhere:
+
+    python bench/bench_world.py
+    python bench/bench_world.py -r 2 10 -s pings -o before.json
+
+'''
+
+
+import os
+import sys
+import time
+import json
+import random
+import platform
+from argparse import ArgumentParser
+
+top = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, top)
+
+try:
+    import conf
+except ImportError:
+    # No conf.py here, so use the defaults
+    import defaults as conf
+    sys.modules['conf'] = conf
+
+import viewselect
+viewselect.select_view_module('none')
+
+import logging
+logging.getLogger('PybotwarLogger').setLevel(logging.WARNING)
+
+from world import box2d
+from game import Game
+
+
+nrobots = [2, 5, 10, 25, 50]
+scenarios = ['move', 'bullets', 'pings']
+
+
+def script(rng, scenario, rnd, model):
+    '''Return the commands for one robot for one tick.
+
+    Robots change course about once a second, and fire or ping
+        depending on the scenario.
+
+    '''
+
+    commands = model._script
+    if not rnd % 60 or not commands:
+        commands = dict(
+            FORCE=rng.randrange(-100, 101),
+            TORQUE=rng.randrange(-100, 101),
+            TURRET=rng.randrange(-100, 101))
+        model._script = commands
+
+    commands = dict(commands)
+    if scenario == 'bullets' and not model._cannonreload:
+        if model.n % 2:
+            commands['FIRE'] = 'X'
+        else:
+            commands['FIRE'] = rng.randrange(3, 30)
+    elif scenario == 'pings':
+        commands['PING'] = True
+
+    return commands
+
+
+def bench(scenario, n, ticks, seed):
+    '''Run one scenario with n robots for the given number of ticks.
+
+    Returns a dictionary with the timings.
+
+    '''
+
+    # Keep dead robots in the arena, so the number of robots
+    #   stays the same for the whole run
+    settings = dict(remove_dead_robots=False)
+    if scenario == 'bullets':
+        # Fire every time the cannon reloads, without overheating
+        settings['cannon_heating_per_shot'] = 0
+    saved = dict((name, getattr(conf, name)) for name in settings)
+    for name, value in settings.items():
+        setattr(conf, name, value)
+
+    try:
+        game = Game(seed=seed)
+        rng = random.Random(seed)
+        w = game.w
+        for i in range(n):
+            name = 'bench%02d' % i
+            model = w.makerobot('bench', name)
+            model._script = None
+            game.models[name] = model
+
+        items = sorted(game.models.items())
+        maxbullets = 0
+        steptime = 0
+
+        t0 = time.time()
+        for rnd in range(ticks):
+            game.rnd = rnd
+            for robotname, model in items:
+                commands = script(rng, scenario, rnd, model)
+                game.apply_commands(robotname, model, commands)
+            w.makepings(rnd)
+            ts = time.time()
+            w.step(False)
+            steptime += time.time() - ts
+            maxbullets = max(maxbullets, len(w.bullets))
+        elapsed = time.time() - t0
+
+    finally:
+        for name, value in saved.items():
+            setattr(conf, name, value)
+
+    return dict(
+        scenario=scenario,
+        robots=n,
+        ticks=ticks,
+        seconds=round(elapsed, 4),
+        step_seconds=round(steptime, 4),
+        ticks_per_second=round(ticks / elapsed, 1),
+        max_bullets=maxbullets,
+        )
+
+
+def main():
+    parser = ArgumentParser(description='Benchmark the simulation core.')
+    parser.add_argument('-r', '--robots', dest='robots',
+                    action='store', type=int, nargs='+', default=nrobots,
+                    help='numbers of robots to try')
+    parser.add_argument('-s', '--scenarios', dest='scenarios',
+                    action='store', nargs='+', choices=scenarios,
+                    default=scenarios,
+                    help='scenarios to run')
+    parser.add_argument('-t', '--ticks', dest='ticks',
+                    action='store', type=int, default=600,
+                    help='ticks to run for each case (60 ticks = 1 second)')
+    parser.add_argument('--seed', dest='seed',
+                    action='store', type=int, default=1,
+                    help='random seed for robot placement and commands')
+    parser.add_argument('-o', '--output', dest='output',
+                    action='store', default=None,
+                    help='write the JSON results to this file')
+    options = parser.parse_args()
+
+    results = []
+    for scenario in options.scenarios:
+        for n in options.robots:
+            r = bench(scenario, n, options.ticks, options.seed)
+            sys.stderr.write('%-8s %3s robots: %8.1f ticks/second\n' % (
+                                scenario, n, r['ticks_per_second']))
+            results.append(r)
+
+    report = dict(
+        python=platform.python_version(),
+        box2d=getattr(box2d, '__version__', None),
+        platform=platform.platform(),
+        seed=options.seed,
+        results=results,
+        )
+
+    out = json.dumps(report, indent=2, sort_keys=True)
+    if options.output is None:
+        print out
+    else:
+        f = open(options.output, 'w')
+        f.write(out)
+        f.write('\n')
+        f.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,6 @@
+from defaults import *
+use_qt_settings = False
+subproc_python = '/root/.pyenv/versions/2.7.18/bin/python'
+pybox2d_version = '2.3.8'
+maxtime = 20
+more_robot_dirs = ['examples', '/tmp/rb']
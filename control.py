@@ -18,53 +18,262 @@
 
 
 import os
+import struct
+import threading
 from threading import Thread
-from time import sleep
+from time import sleep, time
+import Queue
+
+try:
+    import resource
+except ImportError:
+    # Not on Windows
+    resource = None
 
 import util
-from util import defaultNonedict
+import protocol
 
 import conf
 
-util.setup_conf()
-
 
 _overtime_count = 0
 
-def loop(r, i):
-    data = i.split('|')
-    sensors = defaultNonedict()
-    for d in data:
-        k, v = d.split(':')
+_batch_ticks = 1 # number of ticks to plan for each time the game asks
+_pending_status = None # ERROR or END found part way through a plan
+_timing = False # add the time spent in respond() to each reply
+_budget = None # Budget, if using fair-share scheduling
 
-        if ';' in v:
-            # Some sensors send multiple values, separated by semicolon
-            v = v.split(';')
-            vconv = []
-            for vv in v:
-                try:
-                    vvconv = int(vv)
-                except:
-                    vvconv = vv
 
-                vconv.append(vvconv)
+def cputime():
+    'Return the CPU time used by this process so far, in seconds.'
 
-        else:
+    if resource is not None:
+        r = resource.getrusage(resource.RUSAGE_SELF)
+        return r.ru_utime + r.ru_stime
+    else:
+        t = os.times()
+        return t[0] + t[1]
+
+
+class Budget(object):
+    '''Fair-share CPU time for one robot (see conf.cpu_budget).
+
+    The robot earns conf.cpu_budget seconds of CPU time for each
+        second of the battle, a little each tick, and can save up to
+        conf.budget_carry seconds. It is charged for the CPU time it
+        really uses. A robot that is out of budget skips ticks until
+        it has earned some more.
+
+    '''
+
+    def __init__(self):
+        self.tokens = conf.budget_carry
+        self.rate = conf.cpu_budget / 60.0
+        self.mark = cputime() # when charge_used() last charged
+
+    def earn(self):
+        'Add the budget for one tick.'
+
+        self.tokens = min(self.tokens + self.rate, conf.budget_carry)
+
+    def charge(self, seconds):
+        self.tokens -= seconds
+
+    def charge_used(self, least=0):
+        '''Charge for all the CPU time this process used since the
+            last time, but at least least seconds.
+        '''
+
+        now = cputime()
+        self.charge(max(now - self.mark, least))
+        self.mark = now
+
+    def timeout(self):
+        '''Return how long the robot may take on the next tick, or 0
+            if it is out of budget.
+        '''
+
+        if self.tokens <= 0:
+            return 0
+        return min(max(self.tokens, conf.tick_timeout), conf.budget_max_tick)
+
+    def bankrupt(self):
+        'Return True if the robot is so far over budget it must be stopped.'
+
+        return self.tokens < -conf.budget_carry
+
+
+class Worker(Thread):
+    '''Long-lived thread that runs the robot's respond() method.
+
+    One Worker is started per robot process and is handed the sensors
+        for each tick through a queue, instead of starting a new
+        thread every tick.
+
+    '''
+
+    def __init__(self, r):
+        Thread.__init__(self)
+        # A robot stuck in respond() must not keep the process alive
+        #   after the battle. stop() ends the thread cleanly otherwise.
+        self.daemon = True
+        self.r = r
+        self._n = 0
+        self._jobs = Queue.Queue()
+        self._done = Queue.Queue()
+
+        # Wall clock and CPU time of the last call that finished in time
+        self.wall = 0
+        self.cpu = 0
+
+    def run(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                break
+            n, sensors = job
+            if _timing:
+                t0, c0 = time(), cputime()
+                get_response(self.r, sensors)
+                self._done.put((n, time() - t0, cputime() - c0))
+            else:
+                get_response(self.r, sensors)
+                self._done.put((n, 0, 0))
+
+    def stop(self):
+        '''Let the thread end once any call still running returns.'''
+
+        self._jobs.put(None)
+
+    def respond(self, sensors, timeout):
+        '''Have the robot respond to sensors.
+
+        Returns True if the robot finished within timeout seconds.
+            If it did not, the call keeps running in the background
+            and the next call will wait behind it.
+
+        '''
+
+        self._n += 1
+        n = self._n
+        self._jobs.put((n, sensors))
+
+        deadline = time() + timeout
+        while True:
+            remaining = deadline - time()
+            if remaining <= 0:
+                return False
             try:
-                vconv = int(v)
-            except:
-                vconv = v
+                done, wall, cpu = self._done.get(True, remaining)
+            except Queue.Empty:
+                return False
+            if done == n:
+                self.wall, self.cpu = wall, cpu
+                return True
+
+
+def loop(r, i, worker):
+    sensors = protocol.parse_sensors(i)
+
+    status, plan, times = run_plan(r, sensors, worker)
+
+    if plan:
+        reply = protocol.format_plan(plan)
+        if _timing:
+            reply += protocol.format_times(*times)
+        return reply
+    else:
+        return status
+
+def loop_binary(r, data, worker):
+    sensors = protocol.unpack_sensors(data)
+
+    status, plan, times = run_plan(r, sensors, worker)
+
+    if plan:
+        try:
+            reply = protocol.pack_plan(plan)
+        except (ValueError, TypeError, struct.error):
+            # The robot set a command to something that is not a number
+            return protocol.pack_status('ERROR')
+        if _timing:
+            reply += protocol.pack_times(*times)
+        return reply
+    else:
+        return protocol.pack_status(status)
+
+def run_plan(r, sensors, worker):
+    '''Have the robot respond for the next _batch_ticks ticks, using
+        the same sensors except for TICK.
+
+    Only robots that set plan_ahead (see robot.Robot) are planned.
+        Other robots respond once, and are asked again next tick.
+
+    Returns a tuple (status, plan, times) where plan is the list of
+        command tuples, status is the reason the plan stopped early
+        (TIMEOUT, ERROR, LOG, etc.) or None, and times is the tuple
+        (wall, cpu) of seconds spent in respond() for the plan.
 
-        sensors[k] = vconv
+    An ERROR or END that comes after the first tick is held back
+        and sent the next time the game asks.
+
+    '''
+
+    global _pending_status
+    if _pending_status is not None:
+        status = _pending_status
+        _pending_status = None
+        return status, [], (0, 0)
+
+    plan = []
+    wall = cpu = 0
+    tick = sensors['TICK']
+    if r.plan_ahead:
+        nticks = _batch_ticks
+    else:
+        nticks = 1
+    for n in range(nticks):
+        if n:
+            sensors = sensors.copy()
+            sensors['TICK'] = tick + n
+
+        response = run_robot(r, sensors, worker)
+        if response is None:
+            wall += worker.wall
+            cpu += worker.cpu
+
+        status = r._p__status()
+        if status is None:
+            commands = r._p__commands()
+        elif status == 'LOG':
+            start_logging(r)
+        elif status == 'NOLOG':
+            stop_logging(r)
+
+        status = response or status
+        if status is not None:
+            if plan and status in ('ERROR', 'END'):
+                _pending_status = status
+            break
+
+        plan.append(commands)
+
+    return status, plan, (wall, cpu)
+
+def run_robot(r, sensors, worker):
+    '''Have the robot respond to the sensors within the tick timeout.
+
+    Returns 'TIMEOUT' if the robot ran out of time, or else None.
+
+    '''
+
+    if _budget is not None:
+        return run_robot_budget(r, sensors, worker)
 
     timeout = conf.tick_timeout
 
-    user_thread = Thread(target=get_response, args=(r, sensors))
     response = None
-    user_thread.start()
-
-    user_thread.join(timeout)
-    if user_thread.isAlive():
+    if not worker.respond(sensors, timeout):
         global _overtime_count
         _overtime_count += 1
         response = 'TIMEOUT'
@@ -73,14 +282,40 @@ def loop(r, i):
     else:
         _overtime_count = 0
 
-    rresponse = r.response
+    return response
 
-    if rresponse == 'LOG':
-        start_logging(r)
-    elif rresponse == 'NOLOG':
-        stop_logging(r)
+def run_robot_budget(r, sensors, worker):
+    '''Have the robot respond to the sensors if it has CPU budget
+        left. The robot is charged for all the CPU time the process
+        used since the last tick, which includes any earlier call
+        that is still running. If the robot does not finish in time,
+        it is charged at least for the time the game waited.
 
-    return response or rresponse
+    Returns 'TIMEOUT' if the robot was out of budget or ran out of
+        time, 'ERROR' if it is bankrupt, or else None.
+
+    '''
+
+    budget = _budget
+    budget.earn()
+
+    timeout = budget.timeout()
+    waited = 0
+    if not timeout:
+        response = 'TIMEOUT'
+    elif worker.respond(sensors, timeout):
+        response = None
+    else:
+        response = 'TIMEOUT'
+        waited = timeout
+
+    budget.charge_used(waited)
+    if budget.bankrupt():
+        # Still using CPU, long after running out of budget. The game
+        #   removes the robot and kills this process.
+        response = 'ERROR'
+
+    return response
 
 def get_response(r, sensors):
     try:
@@ -93,6 +328,21 @@ def get_response(r, sensors):
         r.log(tb)
 
 def communicate(r):
+    global _budget
+    if conf.cpu_budget:
+        _budget = Budget()
+
+    worker = Worker(r)
+    worker.start()
+    try:
+        communicate_text(r, worker)
+    finally:
+        worker.stop()
+        worker.join(conf.tick_timeout)
+
+def communicate_text(r, worker):
+    global _batch_ticks, _timing
+
     while True:
         line = sys.stdin.readline().strip()
         if line == 'FINISH':
@@ -105,8 +355,36 @@ def communicate(r):
         elif line == 'NODEBUG':
             stop_logging(r)
             continue
+        elif line.startswith(protocol.BATCH % ''):
+            try:
+                _batch_ticks = max(1, min(int(line.split(':')[1]),
+                                            protocol.MAX_BATCH))
+            except ValueError:
+                pass
+            try:
+                sys.stdout.write('%s\n' % (protocol.BATCH % _batch_ticks))
+                sys.stdout.flush()
+            except IOError:
+                break
+            continue
+        elif line == protocol.TIMING:
+            _timing = True
+            try:
+                sys.stdout.write('%s\n' % line)
+                sys.stdout.flush()
+            except IOError:
+                break
+            continue
+        elif line == protocol.PROTOCOL_BINARY:
+            try:
+                sys.stdout.write('%s\n' % line)
+                sys.stdout.flush()
+            except IOError:
+                break
+            communicate_binary(r, worker)
+            break
 
-        o = loop(r, line)
+        o = loop(r, line, worker)
         if o is not None:
             oline = '%s\n' % (str(o))
             try:
@@ -123,6 +401,34 @@ def communicate(r):
                 pass
             break
 
+def communicate_binary(r, worker):
+    read = sys.stdin.read
+    sensors_size = protocol.SENSORS.size
+
+    while True:
+        kind = read(1)
+        if kind == protocol.FINISH:
+            break
+        elif not kind:
+            break
+        elif kind == protocol.DEBUG:
+            start_logging(r)
+            continue
+        elif kind == protocol.NODEBUG:
+            stop_logging(r)
+            continue
+
+        data = read(sensors_size)
+        if len(data) != sensors_size:
+            break
+
+        o = loop_binary(r, data, worker)
+        try:
+            sys.stdout.write(o)
+            sys.stdout.flush()
+        except IOError:
+            break
+
 
 def robot_logfile(robotname):
     logfilename = '%s.log' % robotname
@@ -146,6 +452,88 @@ def stop_logging(robot):
     robot._p__logfile = None
 
 
+def reset():
+    'Forget everything about the last robot, before loading a new one.'
+
+    global _overtime_count, _batch_ticks, _pending_status, _timing
+    global _budget
+    _overtime_count = 0
+    _batch_ticks = 1
+    _pending_status = None
+    _timing = False
+    _budget = None
+
+def load_robot(modname, rfile, robotname, testmode):
+    '''Load the robot in a separate thread, giving up after the
+        init timeout.
+
+    Returns the robot, or None if it failed to load in time.
+
+    '''
+
+    timeout = conf.init_timeout
+
+    rbox = [] # Store the robot here to pass it back from the thread
+    user_thread = Thread(target=build_robot, args=(modname, rfile, robotname, testmode, rbox))
+    user_thread.start()
+
+    user_thread.join(timeout)
+    if user_thread.isAlive():
+        rbox = [None]
+
+    return rbox[0]
+
+def run(modname, rfile, robotname, testmode):
+    '''Load the robot and talk to the game until the battle ends.'''
+
+    robot = load_robot(modname, rfile, robotname, testmode)
+
+    if robot is None:
+        # robot failed to load properly
+        oline = 'ERROR\n'
+        sys.stdout.write(oline)
+        sys.stdout.flush()
+
+    else:
+        oline = 'START\n'
+        sys.stdout.write(oline)
+        sys.stdout.flush()
+        communicate(robot)
+        stop_logging(robot)
+
+def run_pool():
+    '''Serve as a warm worker in the game's pool.
+
+    Reports READY, then waits for a RESET line naming the robot to
+        load. After each battle the worker reports READY again and
+        waits for the next robot. The worker exits when its input is
+        closed, or if a robot left a thread running, since then the
+        process is not clean enough to be used again.
+
+    '''
+
+    while True:
+        if threading.active_count() > 1:
+            break
+        try:
+            sys.stdout.write('%s\n' % protocol.READY)
+            sys.stdout.flush()
+        except IOError:
+            break
+
+        line = sys.stdin.readline().strip()
+        args = protocol.parse_reset(line)
+        if args is None:
+            break
+
+        modname, rfile, robotname, testmode = args
+
+        # Load the robot module fresh, even if it was used before
+        sys.modules.pop(modname, None)
+        reset()
+        run(modname, rfile, robotname, testmode)
+
+
 def build_robot(modname, rfile, robotname, testmode, rbox):
 
     if testmode:
@@ -184,7 +572,15 @@ def build_robot(modname, rfile, robotname, testmode, rbox):
 if __name__ == '__main__':
     import sys
 
-    if len(sys.argv) != 5:
+    util.setup_conf()
+
+    if sys.argv[1:] == [protocol.POOL]:
+        try:
+            run_pool()
+        except KeyboardInterrupt:
+            pass
+
+    elif len(sys.argv) != 5:
         raise SystemExit
     else:
         modname = sys.argv[1]
@@ -192,29 +588,7 @@ if __name__ == '__main__':
         robotname = sys.argv[3]
         testmode = bool(int(sys.argv[4]))
 
-        timeout = conf.init_timeout
-
-        rbox = [] # Store the robot here to pass it back from the thread
-        user_thread = Thread(target=build_robot, args=(modname, rfile, robotname, testmode, rbox))
-        user_thread.start()
-
-        user_thread.join(timeout)
-        if user_thread.isAlive():
-            rbox = [None]
-
-        robot = rbox[0]
-
-        if robot is None:
-            # robot failed to load properly
-            oline = 'ERROR\n'
-            sys.stdout.write(oline)
-            sys.stdout.flush()
-
-        else:
-            oline = 'START\n'
-            sys.stdout.write(oline)
-            sys.stdout.flush()
-            try:
-                communicate(robot)
-            except KeyboardInterrupt:
-                pass
+        try:
+            run(modname, rfile, robotname, testmode)
+        except KeyboardInterrupt:
+            pass
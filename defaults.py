@@ -7,8 +7,37 @@ subproc_python = '/usr/bin/python'
 subproc_main = 'control.py'
 
 init_timeout = 1.0
+think_times = False # Robots report the time spent in each respond() call
+startup_timeout = 10.0 # Seconds to wait for all robot processes to start
 tick_timeout = 0.015
 
+cpu_budget = 0 # Fair-share scheduling: seconds of CPU time each robot may
+               # use per second of battle, on average. Robots can think
+               # longer now and then if they stay in budget. 0 means
+               # use the fixed tick_timeout for every tick instead.
+budget_carry = 1.0 # Most unused CPU time (seconds) a robot can save up
+budget_max_tick = 0.1 # Longest the game waits for a robot on any one tick
+budget_grace = 5 # Seconds without a reply before a robot is removed
+
+concurrent_ticks = False # Send sensors to all robots, then gather replies
+                         # (uses select(), so not available on Windows)
+
+wire_protocol = 'text' # 'text' or 'binary' (packed fixed-size records)
+
+batch_ticks = 1 # Robots that set plan_ahead may send commands for up
+                # to this many ticks at once. The plan is cut short if
+                # the robot is pinged or damaged. 1 means no batching.
+
+# Trusted robots can be run inside the game process instead of in a
+#   separate process. This is much faster, but the robot code is not
+#   isolated from the game at all. Only use this for code you trust.
+inprocess = False # run all robots in the game process
+inprocess_robots = [] # or, run only robots with these module names
+
+worker_pool = 0 # Number of robot processes to start ahead of time and
+                # keep between battles of a tournament. 0 means start
+                # a new process for each robot in each battle.
+
 
 # Robot selection
 base_dir = 'robots' # user robot files generally stored here
@@ -31,6 +60,12 @@ template = 'template.py'
 
 lineups = 'lineups' # relative to robot_dirs[0]
 
+record_replays = False # Save every battle to a replay file
+replay_dir = 'replays' # relative to robot_dirs[0]
+
+profile = False # Time each phase of every tick and report at the end
+profile_dir = 'profiles' # relative to robot_dirs[0]
+
 
 # Game
 maxtime = 600 # Seconds before calling the match a draw
@@ -46,8 +81,13 @@ collision_damage_factor = 0.15 # Collision damage = (cdf * (impulse - cds))**2 +
 
 remove_dead_robots = True
 
+console_log_level = 'info' # Battle events shown on the console
+turbo_log_level = 'warning' # Events shown when running with --turbo
+
 graphical_display = True
 
+use_numpy = True # Use numpy (if installed) for the robot sensors each tick
+
 
 # Physics
 pybox2d_version = '2.3b0'
@@ -83,6 +123,9 @@ bulletspeed = 40
 
 bullet_density = .2
 
+bullet_pool = 100 # Spent bullets kept to be fired again, instead of
+                  # making a new body for every shot. 0 means no pool.
+
 
 # Statistics
 dbfile = 'stats.db' # relative to robot_dirs[0]
@@ -19,6 +19,7 @@
 
 import subprocess
 from subprocess import PIPE
+import select
 import time
 import random
 import os
@@ -34,29 +35,60 @@ from world import box2d
 
 import stats
 import util
+import protocol
+import inproc
+import replay
+import profiler
+from profiler import clock
 import conf
 
 
 class Game(object):
-    def __init__(self, testmode=False, tournament=None):
+    def __init__(self, testmode=False, tournament=None, pool=None,
+                    fork=None, seed=None, robots=None):
         self.testmode = testmode
         self.tournament = tournament
+        self.robots = robots # robots to load, or None for conf.robots
+        self.pool = pool # pool.WorkerPool of warm robot processes, or None
+        self.fork = fork # snapshot() of a battle to start from, or None
+
+        # The same seed and lineup give the same battle, as long as
+        #   the robots themselves do the same thing.
+        if seed is None:
+            seed = random.randrange(2**31)
+        self.seed = seed
+        self.random = random.Random(seed)
 
         self.models = {}
         self.procs = {}
         self.results = {}
         self.timeouts = {}
+        self.binary = set() # robots using the binary protocol
+        self.inprocess = set() # robots running inside the game process
+        self.plans = {} # commands for upcoming ticks in batch mode
+        self.sensors = {} # World.sensor_snapshot() for this tick
+        self.planhealth = {} # robot health when the plan was made
+        self.recorder = None # replay.Recorder if recording this battle
+        self.profiler = None # profiler.Profiler if profiling this battle
+        self.timing = set() # robots reporting their think times
+        self.thinktimes = {} # robotname -> profiler.ThinkTime
+        self.think_results = {} # robotname -> (kind,) + ThinkTime.summary()
         self.rnd = 0
+        if fork is not None:
+            self.rnd = fork['rnd']
 
-        self.w = world.World()
+        self.w = world.World(random.Random(self.random.random()))
+        if conf.profile:
+            self.profiler = profiler.Profiler()
+            self.w.profiler = self.profiler
         self.cl = world.CL()
         self.w.w.contactListener = self.cl
         self.cl.w = self.w
 
-    def run(self):
+    def run(self, update_stats=True):
         self.load_robots()
         if not self.nrobots:
-            self.finish()
+            self.finish(update_stats)
             return
 
         while ((self.testmode and not self.tournament)
@@ -64,7 +96,7 @@ class Game(object):
             if self.rnd > 60 * conf.maxtime:
                 break
             self.tick()
-        self.finish()
+        self.finish(update_stats)
 
     def robot_module_file(self, robot):
         for d in util.get_robot_dirs():
@@ -75,198 +107,603 @@ class Game(object):
         return None
 
     def load_robots(self):
-        robots = conf.robots
+        '''Start all of the robots, then wait for all of them to
+            report in. Setup takes as long as the slowest robot,
+            up to conf.startup_timeout seconds.
+        '''
+
+        robots = self.robots
+        if robots is None:
+            robots = conf.robots
+        self.lineup = list(robots)
+        print 'SEED', self.seed
+        names = set()
+        launched = []
         for robot in robots:
             robotname = robot
-            while robotname in self.w.robots:
+            while robotname in names:
                 robotname += '_'
             rfile = self.robot_module_file(robot)
             if rfile is None:
                 continue
+            names.add(robotname)
             print 'STARTING', robotname, rfile
-            proc = subprocess.Popen([conf.subproc_python,
-                                        conf.subproc_main,
-                                        robot, rfile, robotname,
-                                        str(int(self.testmode))],
-                                        stdin=PIPE, stdout=PIPE)
-            try:
-                result = proc.stdout.readline().strip()
-            except IOError:
-                result = 'FAIL'
+            proc, result = self.launch_robot(robot, rfile, robotname)
+            launched.append((robot, robotname, proc, result))
+
+        results = self.gather_starts(launched)
+
+        if self.fork is not None:
+            forkrobots = list(self.fork['world']['robots'])
+            renamed = {}
 
+        for robot, robotname, proc, result in launched:
+            result = results.get(robotname, 'FAIL')
             if result == 'START':
-                print 'STARTED'
-                model = self.w.makerobot(robot, robotname)
+                print 'STARTED', robotname
+                if robotname in self.inprocess:
+                    pass
+                else:
+                    if conf.batch_ticks > 1:
+                        batch = min(conf.batch_ticks, protocol.MAX_BATCH)
+                        self.negotiate(proc, protocol.BATCH % batch)
+                    if conf.think_times:
+                        if self.negotiate(proc, protocol.TIMING):
+                            self.timing.add(robotname)
+                    if conf.wire_protocol == 'binary':
+                        if self.negotiate(proc, protocol.PROTOCOL_BINARY):
+                            self.binary.add(robotname)
+                if self.fork is not None and forkrobots:
+                    # Take over the next robot in the forked battle
+                    d = dict(forkrobots.pop(0))
+                    renamed[d['name']] = robotname
+                    d['kind'], d['name'] = robot, robotname
+                    # Only count what this robot does after the fork
+                    d['_outlasted'] = d['_damage_caused'] = d['_kills'] = 0
+                    self.w.restore(dict(robots=[d], bullets=[]))
+                    model = self.w.robots[robotname]
+                else:
+                    model = self.w.makerobot(robot, robotname)
                 self.models[robotname] = model
                 self.procs[robotname] = proc
                 self.timeouts[robotname] = 0
+                if conf.think_times:
+                    self.thinktimes[robotname] = profiler.ThinkTime()
             elif result in ['ERROR', 'END']:
-                print 'ERROR!'
+                print 'ERROR!', robotname
+                if self.pool is not None:
+                    self.pool.release(proc)
+                elif not inproc.use_inprocess(robot):
+                    self.kill_proc(proc)
             else:
-                print 'FAIL', result
+                print 'FAIL', robotname, result
+                if proc is None or robotname in self.inprocess:
+                    pass
+                elif self.pool is not None:
+                    self.pool.discard(proc)
+                else:
+                    self.kill_proc(proc)
+
+        if self.fork is not None:
+            bullets = []
+            for d in self.fork['world']['bullets']:
+                if d['shooter'] in renamed:
+                    d = dict(d)
+                    d['shooter'] = renamed[d['shooter']]
+                    bullets.append(d)
+            self.w.restore(dict(robots=[], bullets=bullets))
 
         self.nrobots = len(self.models)
-        self.t0 = int(time.time())
+        self.t0 = time.time()
+
+        if conf.record_replays and self.models:
+            models = sorted(self.models.values(), key=lambda model: model.n)
+            robots = [(model.name, model.kind) for model in models]
+            self.replay_path = replay.new_replay_path()
+            self.recorder = replay.Recorder(self.replay_path, robots)
+
+    def launch_robot(self, robot, rfile, robotname):
+        '''Start the robot, without waiting for it to report in.
+
+        Returns a tuple (proc, result) where result is None until the
+            robot reports in. Robots running in the game process are
+            loaded right away, so their result is known.
+
+        '''
+
+        result = None
+        if inproc.use_inprocess(robot):
+            proc = inproc.InProcessRobot(robot, rfile, robotname,
+                                            self.testmode)
+            result = proc.start()
+            if result == 'START':
+                self.inprocess.add(robotname)
+        elif self.pool is not None:
+            proc = self.pool.launch(robot, rfile, robotname,
+                                        self.testmode)
+        else:
+            proc = subprocess.Popen([conf.subproc_python,
+                                        conf.subproc_main,
+                                        robot, rfile, robotname,
+                                        str(int(self.testmode))],
+                                        stdin=PIPE, stdout=PIPE)
+
+        return proc, result
+
+    def gather_starts(self, launched):
+        '''Wait for the launched robots to report START or ERROR.
+
+        Returns a dictionary of robotname -> result. Robots that have
+            not reported by the deadline are left out.
+
+        '''
+
+        results = {}
+        waiting = {}
+        for robot, robotname, proc, result in launched:
+            if result is not None:
+                results[robotname] = result
+            elif proc is not None:
+                waiting[proc.stdout.fileno()] = robotname, proc
+
+        deadline = time.time() + conf.startup_timeout
+        while waiting:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                ready, _, _ = select.select(waiting.keys(), [], [], remaining)
+            except select.error:
+                # select() does not work with pipes on Windows
+                ready = waiting.keys()
+            for fd in ready:
+                robotname, proc = waiting.pop(fd)
+                try:
+                    results[robotname] = proc.stdout.readline().strip()
+                except IOError:
+                    results[robotname] = 'FAIL'
+
+        return results
+
+    def snapshot(self):
+        '''Return the state of the battle, to start other battles
+            from this point with Game(fork=snapshot)
+
+        The robots in the new battle take over the robots in the
+            snapshot in order, so they may be different robots than
+            the ones in this battle. Robot programs always start
+            fresh, since their own state cannot be saved.
+
+        '''
+
+        return dict(rnd=self.rnd, world=self.w.snapshot())
+
+    def negotiate(self, proc, line):
+        '''Ask the robot process to switch on an optional feature.
+
+        Returns True if the robot process agreed by sending back the
+            same line.
+
+        '''
+
+        try:
+            proc.stdin.write('%s\n' % line)
+            reply = proc.stdout.readline().strip()
+        except IOError:
+            return False
+
+        return reply == line
+
+    def tick(self, render=True):
+        prof = self.profiler
+        if prof is not None:
+            t0 = clock()
+
+        # Sorted first so the order depends only on the seed
+        items = sorted(self.models.items())
+        self.random.shuffle(items)
+
+        if prof is not None:
+            t = clock()
+        self.sensors = self.w.sensor_snapshot(self.rnd)
+        if prof is not None:
+            prof.lap('sensors', t)
+
+        if conf.concurrent_ticks:
+            self.tick_concurrent(items)
+        else:
+            self.tick_serial(items)
+
+        if prof is not None:
+            t = clock()
+        self.w.makepings(self.rnd)
+        if prof is not None:
+            prof.lap('pings', t)
+
+        self.w.step(render)
+
+        if self.recorder is not None:
+            if prof is not None:
+                t = clock()
+            self.recorder.record(self.rnd, self.w)
+            if prof is not None:
+                prof.lap('record', t)
 
-    def tick(self):
-        procs = self.procs
-        nrobots = self.nrobots
-        timeouts = self.timeouts
-        w = self.w
         rnd = self.rnd
-        result = ''
+        if not rnd%60:
+            logger.info('%s seconds (%s real)', rnd/60,
+                            int(time.time()-self.t0))
+        self.rnd += 1
 
-        items = self.models.items()
-        random.shuffle(items)
-        for robotname, model in items:
-            if robotname not in self.procs:
-                continue
+        if prof is not None:
+            prof.tick(clock() - t0)
 
-            proc = procs[robotname]
+    def tick_serial(self, items):
+        'Send each robot its sensor line and wait for its reply in turn.'
 
-            if model._enable_debug is None:
-                pass
-            elif model._enable_debug:
-                line = 'DEBUG\n'
-                proc.stdin.write(line)
-                model._enable_debug = None
+        procs = self.procs
+        prof = self.profiler
+        t = None
+        for robotname, model in items:
+            if prof is not None:
+                t = clock()
+            line = self.tick_line(robotname, model)
+            if prof is not None:
+                t = prof.lap('sensors', t, robotname)
+            if line is None:
                 continue
-            else:
-                line = 'NODEBUG\n'
-                proc.stdin.write(line)
-                model._enable_debug = None
+            elif not line:
+                self.tick_result(robotname, model, '', self.plans.pop(robotname))
                 continue
 
-            health = model.health
-            body = model.body
-            pos = body.position
-            possens = '%s;%s' % (int(pos.x), int(pos.y))
-            tur = model.get_turretangle()
-            ping = '%s;%s;%s' % (model._pingtype,
-                                    model._pingangle,
-                                    model._pingdist)
-            gyro = model.gyro()
-            heat = int(model._cannonheat)
-            loading = int(model._cannonreload)
-            pinged = int(model._pinged == rnd - 1)
-            line = 'TICK:%s|HEALTH:%s|POS:%s|TUR:%s|PING:%s|GYRO:%s|HEAT:%s|LOADING:%s|PINGED:%s\n' % (rnd, health, possens, tur, ping, gyro, heat, loading, pinged)
-            #print robotname, line
-
-            if not model.alive:
-                model._outlasted = nrobots - len(procs)
-                del procs[robotname]
-                print 'DEAD robot', robotname, 'health is 0'
-                proc.stdin.flush()
-                proc.stdin.close()
-                proc.stdout.close()
-                proc.kill()
-                time.sleep(0.1)
-                model._commands = {'INACTIVE':'DEAD'}
+            proc = procs[robotname]
+            if robotname in self.inprocess:
+                result, plan = proc.tick(line)
+                if prof is not None:
+                    prof.lap('wait', t, robotname)
+                self.add_think_time(robotname, proc.times, plan)
+                self.tick_result(robotname, model, result, plan)
                 continue
 
-            proc.stdin.write(line)
+            if not self.send(robotname, line):
+                continue
+            if prof is not None:
+                t = prof.lap('write', t, robotname)
             try:
-                result = proc.stdout.readline().strip()
+                result, plan = self.read_result(robotname, proc, t)
             except IOError:
                 print 'ERROR with', robotname
                 continue
 
-            if result == 'TIMEOUT':
-                timeouts[robotname] += 1
-                if timeouts[robotname] > 5:
-                    del procs[robotname]
-                    print 'REMOVED robot', robotname, 'due to excessive timeouts'
-                    proc.stdin.flush()
-                    proc.stdin.close()
-                    proc.stdout.close()
-                    proc.kill()
-
-            elif result == 'END':
-                del procs[robotname]
-                print 'FINISHED: robot', robotname
-                proc.stdin.flush()
-                proc.stdin.close()
-                proc.stdout.close()
-                proc.kill()
-
-            elif result == 'ERROR':
-                del procs[robotname]
-                print 'ERROR: robot', robotname
-                proc.stdin.flush()
-                proc.stdin.close()
-                proc.stdout.close()
-                proc.kill()
+            self.tick_result(robotname, model, result, plan)
 
-            else:
-                timeouts[robotname] = 0
+    def tick_concurrent(self, items):
+        '''Send every robot its sensor line first, then collect the
+            replies as they arrive. The tick takes as long as the
+            slowest robot instead of the sum of all of them.
 
+        Replies are still handled in the (shuffled) order of items.
+        '''
 
-            #print 'RR', result, 'RR'
-            commands = {}
-            try:
-                props = result.split('|')
-                for prop in props:
-                    kind, val = prop.split(':')
-                    try:
-                        vconv = int(val)
-                    except ValueError:
-                        pass
-                    else:
-                        val = vconv
-                    commands[kind] = val
-            except ValueError:
+        procs = self.procs
+        prof = self.profiler
+        waiting = {}
+        results = {}
+        sent = {}
+        for robotname, model in items:
+            if prof is not None:
+                t = clock()
+            line = self.tick_line(robotname, model)
+            if prof is not None:
+                t = prof.lap('sensors', t, robotname)
+            if line is None:
+                continue
+            elif not line:
+                results[robotname] = '', self.plans.pop(robotname)
                 continue
 
-            #print 'KV', kind, val
-            #print 'R', model, 'R', result, 'R'
-            #print 'R', robotname, 'T', '%s -> %.3f' % (model._turretangletarget, model.turretjoint.angle)
-
-            model._commands = commands or {'INACTIVE':result}
-
-            for kind, val in commands.items():
-                if kind == 'FORCE':
-                    # Make sure force is not more than 100% or less than -100%
-                    val = min(val, 100)
-                    val = max(-100, val)
-                    force = conf.maxforce * val/100.0
-                    localforce = box2d.b2Vec2(val, 0)
-                    worldforce = body.GetWorldVector(localforce)
-                    body.ApplyForce(worldforce, pos, True)
-                elif kind == 'TORQUE':
-                    # Make sure torque is not more than 100% or less than -100%
-                    val = min(val, 100)
-                    val = max(-100, val)
-                    torque = conf.maxtorque * val/100.0
-                    body.ApplyTorque(torque, True)
-                elif kind == 'FIRE':
-                    if val == '_':
-                        # no fire
-                        pass
-                    elif val == 'X':
-                        # non-exploding shell
-                        w.makebullet(robotname)
-                    else:
-                        # exploding shell
-                        ticks = int(60 * val / conf.bulletspeed)
-                        w.makebullet(robotname, ticks)
-                elif kind == 'PING':
-                    if val:
-                        kind, angle, dist = w.makeping(robotname, rnd)
-                        if kind is not None:
-                            model._pingtype = kind[0]
-                            model._pingangle = angle
-                            model._pingdist = int(dist)
-                elif kind == 'TURRET':
-                    val = min(val, 100)
-                    val = max(-100, val)
-                    torque = conf.turret_maxMotorSpeed * val/100.0
-                    model.turretcontrol(torque)
-
-        w.step()
+            proc = procs[robotname]
+            if robotname in self.inprocess:
+                results[robotname] = proc.tick(line)
+                if prof is not None:
+                    prof.lap('wait', t, robotname)
+                self.add_think_time(robotname, proc.times,
+                                        results[robotname][1])
+                continue
 
-        if not rnd%60:
-            print '%s seconds (%s real)' % (rnd/60, int(time.time())-self.t0)
-        self.rnd += 1
+            if not self.send(robotname, line):
+                continue
+            if prof is not None:
+                sent[robotname] = prof.lap('write', t, robotname)
+            waiting[proc.stdout.fileno()] = robotname
+
+        if prof is not None:
+            t = clock()
+            parsing = prof.totals['parse']
+
+        while waiting:
+            ready, _, _ = select.select(waiting.keys(), [], [])
+            for fd in ready:
+                robotname = waiting.pop(fd)
+                proc = procs[robotname]
+                try:
+                    results[robotname] = self.read_result(robotname, proc,
+                                                sent.get(robotname), False)
+                except IOError:
+                    print 'ERROR with', robotname
+
+        if prof is not None:
+            # The robots were all waited for at once
+            parsing = prof.totals['parse'] - parsing
+            prof.add('wait', clock() - t - parsing)
+
+        for robotname, model in items:
+            if robotname in results:
+                result, plan = results[robotname]
+                self.tick_result(robotname, model, result, plan)
+
+    def tick_line(self, robotname, model):
+        '''Return the line of sensor data to send to the robot
+            this tick, or None if nothing should be sent.
+
+        Returns '' if the robot should follow its plan this tick.
+
+        Robots running in the game process get the tuple of sensor
+            values instead of a line.
+
+        '''
+
+        if robotname not in self.procs:
+            return None
+
+        proc = self.procs[robotname]
+        rnd = self.rnd
+        binary = robotname in self.binary
+
+        if model._enable_debug is None:
+            pass
+        elif robotname in self.inprocess:
+            proc.debug(model._enable_debug)
+            model._enable_debug = None
+            return None
+        elif model._enable_debug:
+            if binary:
+                line = protocol.DEBUG
+            else:
+                line = 'DEBUG\n'
+            self.send(robotname, line)
+            model._enable_debug = None
+            return None
+        else:
+            if binary:
+                line = protocol.NODEBUG
+            else:
+                line = 'NODEBUG\n'
+            self.send(robotname, line)
+            model._enable_debug = None
+            return None
+
+        if not model.alive:
+            model._outlasted = self.nrobots - len(self.procs)
+            self.close_proc(robotname)
+            print 'DEAD robot', robotname, 'health is 0'
+            time.sleep(0.1)
+            model._commands = {'INACTIVE':'DEAD'}
+            return None
+
+        if robotname in self.plans:
+            pinged = model._pinged == rnd - 1
+            hurt = model.health != self.planhealth[robotname]
+            if pinged or hurt:
+                # Something happened. Get a new plan from the robot.
+                del self.plans[robotname]
+            else:
+                return ''
+
+        sensors = self.sensors[robotname]
+
+        if robotname in self.inprocess:
+            line = sensors
+        elif binary:
+            line = protocol.pack_sensors(sensors)
+        else:
+            line = protocol.format_sensors(sensors)
+        #print robotname, line
+
+        return line
+
+    def read_result(self, robotname, proc, sent=None, total=True):
+        '''Read one reply from the robot process.
+
+        Returns a tuple (result, plan). See protocol.read_reply
+
+        When profiling, sent is the time the robot's line was sent,
+            and the time from then until the reply is read counts as
+            waiting for the robot. If total is False, that time only
+            counts for the robot and not in the profile totals.
+
+        '''
+
+        prof = self.profiler
+        timing = robotname in self.timing
+
+        if robotname in self.binary:
+            result, plan = protocol.read_reply(proc.stdout)
+            if timing and plan is not None:
+                times = protocol.read_times(proc.stdout)
+                self.add_think_time(robotname, times, plan)
+            if prof is not None:
+                prof.add('wait', clock() - sent, robotname, total)
+            return result, plan
+        else:
+            line = proc.stdout.readline()
+            if prof is not None:
+                t = clock()
+                prof.add('wait', t - sent, robotname, total)
+            result = line.strip()
+            if timing:
+                result, times = protocol.split_times(result)
+            plan = protocol.parse_plan(result)
+            if timing and plan is not None:
+                self.add_think_time(robotname, times, plan)
+            if prof is not None:
+                prof.lap('parse', t, robotname)
+            return result, plan
+
+    def add_think_time(self, robotname, times, plan):
+        '''Count the (wall, cpu) times the robot reported for
+            making the plan.
+        '''
+
+        thinktime = self.thinktimes.get(robotname)
+        if thinktime is None or times is None or plan is None:
+            return
+
+        wall, cpu = times
+        thinktime.add(wall, cpu, len(plan))
+
+    def send(self, robotname, line):
+        '''Write line to the robot's process.
+
+        Returns False if the process has already ended (for example
+            it was killed). The robot is then removed from the battle.
+
+        '''
+
+        try:
+            self.procs[robotname].stdin.write(line)
+        except IOError:
+            self.close_proc(robotname)
+            print 'ERROR: robot', robotname, 'process ended'
+            return False
+
+        return True
+
+    def tick_result(self, robotname, model, result, plan):
+        '''Handle one reply from a robot, and carry out its commands.
+
+        plan is the list of commands for this tick and any following
+            ticks, or None if the reply did not hold commands.
+
+        '''
+
+        timeouts = self.timeouts
+
+        if result == 'TIMEOUT':
+            timeouts[robotname] += 1
+            thinktime = self.thinktimes.get(robotname)
+            if thinktime is not None:
+                thinktime.add_timeout()
+            if conf.cpu_budget:
+                # Skipping ticks is normal. Only remove stuck robots.
+                limit = 60 * conf.budget_grace
+            else:
+                limit = 5
+            if timeouts[robotname] > limit:
+                self.close_proc(robotname)
+                print 'REMOVED robot', robotname, 'due to excessive timeouts'
+
+        elif result == 'END':
+            self.close_proc(robotname)
+            print 'FINISHED: robot', robotname
+
+        elif result == 'ERROR':
+            self.close_proc(robotname)
+            print 'ERROR: robot', robotname
+
+        else:
+            timeouts[robotname] = 0
+
+
+        #print 'RR', result, 'RR'
+        if plan is None:
+            return
+
+        commands = plan.pop(0)
+        if plan and robotname in self.procs:
+            self.plans[robotname] = plan
+            self.planhealth[robotname] = model.health
+
+        #print 'KV', kind, val
+        #print 'R', model, 'R', result, 'R'
+        #print 'R', robotname, 'T', '%s -> %.3f' % (model._turretangletarget, model.turretjoint.angle)
+
+        model._commands = commands or {'INACTIVE':result}
+
+        prof = self.profiler
+        if prof is not None:
+            t = clock()
+        self.apply_commands(robotname, model, commands)
+        if prof is not None:
+            prof.lap('apply', t, robotname)
+
+    def apply_commands(self, robotname, model, commands):
+        w = self.w
+        rnd = self.rnd
+        body = model.body
+        pos = body.position
+
+        for kind, val in commands.items():
+            if kind == 'FORCE':
+                # Make sure force is not more than 100% or less than -100%
+                val = min(val, 100)
+                val = max(-100, val)
+                force = conf.maxforce * val/100.0
+                localforce = box2d.b2Vec2(val, 0)
+                worldforce = body.GetWorldVector(localforce)
+                body.ApplyForce(worldforce, pos, True)
+            elif kind == 'TORQUE':
+                # Make sure torque is not more than 100% or less than -100%
+                val = min(val, 100)
+                val = max(-100, val)
+                torque = conf.maxtorque * val/100.0
+                body.ApplyTorque(torque, True)
+            elif kind == 'FIRE':
+                if val == '_':
+                    # no fire
+                    pass
+                elif val == 'X':
+                    # non-exploding shell
+                    w.makebullet(robotname)
+                else:
+                    # exploding shell
+                    ticks = int(60 * val / conf.bulletspeed)
+                    w.makebullet(robotname, ticks)
+            elif kind == 'PING':
+                if val:
+                    # Done for all robots at once. See World.makepings
+                    w.pings.append(robotname)
+            elif kind == 'TURRET':
+                val = min(val, 100)
+                val = max(-100, val)
+                torque = conf.turret_maxMotorSpeed * val/100.0
+                model.turretcontrol(torque)
+
+    def close_proc(self, robotname):
+        'Stop talking to the robot and kill its process.'
+
+        proc = self.procs.pop(robotname)
+        self.plans.pop(robotname, None)
+        if robotname in self.inprocess:
+            proc.close()
+            return
+
+        try:
+            proc.stdin.flush()
+        except IOError:
+            pass
+        self.kill_proc(proc)
+
+    def kill_proc(self, proc):
+        'Kill a robot process, close its pipes and wait for it to end.'
+
+        try:
+            proc.stdin.close()
+            proc.stdout.close()
+            proc.kill()
+        except (IOError, OSError):
+            pass
+        proc.wait()
 
     def enable_debug(self):
         items = self.models.items()
@@ -310,16 +747,44 @@ class Game(object):
             print 'Test mode ended'
             winner = None
 
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+            print 'Replay saved to', self.replay_path
+
+        if hasattr(self, 't0'):
+            simulated = self.rnd / 60.0
+            wall = time.time() - self.t0
+            if wall > 0:
+                print 'Simulated %.1f seconds in %.1f seconds (%.1fx real time)' % (
+                                            simulated, wall, simulated/wall)
+
+        if self.profiler is not None:
+            self.profiler.report()
+            path = profiler.new_profile_path()
+            try:
+                self.profiler.write_csv(path)
+            except (IOError, OSError), e:
+                print 'Could not save profile:', e
+            else:
+                print 'Profile saved to', path
+
         for robotname, model in models.items():
             print robotname, 'caused', model._damage_caused, 'damage'
-            if robotname in procs:
-                line = 'FINISH\n'
-                proc = procs[robotname]
-                proc.stdin.write(line)
-                proc.stdin.flush()
-                proc.stdin.close()
-                proc.stdout.close()
-                del procs[robotname]
+            if robotname in self.inprocess and robotname in procs:
+                procs.pop(robotname).close()
+            elif robotname in procs:
+                if robotname in self.binary:
+                    line = protocol.FINISH
+                else:
+                    line = 'FINISH\n'
+                if self.send(robotname, line):
+                    proc = procs.pop(robotname)
+                    if self.pool is not None:
+                        self.pool.release(proc)
+                    else:
+                        proc.stdin.close()
+                        proc.stdout.close()
 
             if winner is None and model.alive:
                 model._outlasted = nrobots - len(alive)
@@ -329,13 +794,57 @@ class Game(object):
             else:
                 win = 0
 
-            if update_stats and not testmode:
-                stats.update(model.kind, win, nrobots-1, model._outlasted,
-                                model._damage_caused, model._kills)
+            self.results[robotname] = (model.kind, model.name, win,
+                                        nrobots-1, model._outlasted,
+                                        model._damage_caused,
+                                        model._kills)
+
+            thinktime = self.thinktimes.get(robotname)
+            if thinktime is not None and thinktime.ticks:
+                print '   ', 'think time', thinktime.describe()
+                self.think_results[robotname] = ((model.kind,) +
+                                                    thinktime.summary())
+
+        if update_stats:
+            save_results(self.results, tournament, testmode,
+                            self.seed, self.lineup, self.think_results)
+
+
+def save_results(results, tournament=None, testmode=False,
+                    seed=None, robots=None, thinktimes=None):
+    '''Write the results of one battle to the stats database.
+
+    results is the Game.results dictionary of
+        robotname -> (kind, name, win, opponents, outlasted,
+                        damage_caused, kills)
+
+    For tournaments, the seed and lineup (list of robots) of the
+        battle are saved too, so the battle can be run again.
+
+    thinktimes is the Game.think_results dictionary of
+        robotname -> (kind, ticks, wall, cpu, maxwall, histogram)
+
+    '''
+
+    if thinktimes and not testmode:
+        for robotname in thinktimes:
+            (kind, ticks, wall, cpu,
+                maxwall, histogram) = thinktimes[robotname]
+            stats.add_think_time(tournament, kind, ticks, wall, cpu,
+                                    maxwall, histogram)
+
+    if tournament is not None and seed is not None:
+        stats.add_battle_seed(tournament, ' '.join(robots), seed)
+
+    for robotname in results:
+        (kind, name, win, opponents, outlasted,
+            damage_caused, kills) = results[robotname]
+
+        if not testmode:
+            stats.update(kind, win, opponents, outlasted,
+                            damage_caused, kills)
 
-            if update_stats and tournament is not None:
-                stats.tournament_update(tournament,
-                                            model.kind, model.name, win,
-                                            nrobots-1, model._outlasted,
-                                            model._damage_caused,
-                                            model._kills)
+        if tournament is not None:
+            stats.tournament_update(tournament, kind, name, win,
+                                        opponents, outlasted,
+                                        damage_caused, kills)
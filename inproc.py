@@ -0,0 +1,145 @@
+# Copyright 2009-2014 Lee Harr
+#
+# This file is part of pybotwar.
+#     http://pybotwar.googlecode.com/
+#
+# Pybotwar is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pybotwar is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Pybotwar.  If not, see <http://www.gnu.org/licenses/>.
+
+
+'''Run trusted robots inside the game process.
+
+Robot code normally runs in its own process (see control.py) and
+    talks to the game over pipes. For trusted robots, like the
+    examples, the robot can instead be loaded in to the game
+    process and called directly. This skips the pipes entirely.
+
+CAUTION!
+A robot run this way can do anything the game itself can do, and
+    cannot be stopped if it goes in to an endless loop. The time
+    limits are checked after each call returns, so a robot that
+    runs too long is counted as timed out, the same as in a
+    separate process.
+
+'''
+
+
+from time import time
+
+import control
+import protocol
+import conf
+
+
+def use_inprocess(kind):
+    'Return True if robots of this kind should run in the game process.'
+
+    return conf.inprocess or kind in conf.inprocess_robots
+
+
+class InProcessRobot(object):
+    def __init__(self, modname, rfile, robotname, testmode):
+        self.modname = modname
+        self.rfile = rfile
+        self.robotname = robotname
+        self.testmode = testmode
+
+        self.r = None
+        self.times = None # (wall, cpu) of the last tick
+        self.budget = None # control.Budget if using fair-share scheduling
+
+    def start(self):
+        '''Load the robot module and initialize the robot.
+
+        Returns START if the robot is ready, or else ERROR.
+
+        '''
+
+        # Keep robot modules from replacing any of the game modules
+        modname = 'pybotwar_robot_%s' % self.modname
+
+        rbox = []
+        t0 = time()
+        control.build_robot(modname, self.rfile, self.robotname,
+                                self.testmode, rbox)
+        if time() - t0 > conf.init_timeout:
+            rbox = [None]
+
+        self.r = rbox[0]
+        if self.r is None:
+            return 'ERROR'
+        else:
+            if conf.cpu_budget:
+                self.budget = control.Budget()
+            return 'START'
+
+    def tick(self, sensors):
+        '''Have the robot respond to the tuple of sensor values.
+
+        Returns a tuple (result, plan) the same as
+            protocol.read_reply
+
+        '''
+
+        r = self.r
+
+        budget = self.budget
+        if budget is None:
+            timeout = conf.tick_timeout
+        else:
+            budget.earn()
+            timeout = budget.timeout()
+            if not timeout:
+                self.times = None
+                return 'TIMEOUT', None
+
+        # Only ask for the CPU time when something will use it
+        usecpu = conf.think_times or budget is not None
+        t0 = time()
+        if usecpu:
+            c0 = control.cputime()
+        control.get_response(r, protocol.sensors_dict(sensors))
+        wall = time() - t0
+        if usecpu:
+            cpu = control.cputime() - c0
+        if conf.think_times:
+            self.times = wall, cpu
+        overtime = wall > timeout
+        if budget is not None:
+            budget.charge(cpu)
+
+        status = r._p__status()
+        if status is None:
+            commands = r._p__commands()
+        elif status == 'LOG':
+            control.start_logging(r)
+        elif status == 'NOLOG':
+            control.stop_logging(r)
+
+        if overtime:
+            return 'TIMEOUT', None
+        elif status is not None:
+            return status, None
+        else:
+            return '', [protocol.commands_dict(*commands)]
+
+    def debug(self, enable):
+        if enable:
+            control.start_logging(self.r)
+        else:
+            control.stop_logging(self.r)
+
+    def close(self):
+        if self.r is not None:
+            control.stop_logging(self.r)
+        self.r = None
@@ -81,24 +81,60 @@ def setup_logging(level='info'):
               'appdebug.log', maxBytes=1000000, backupCount=3)
     logger.addHandler(handler)
 
-def run_supertournament(nbattles):
-    robots = conf.robots
-    nrobots = len(robots)
-    import datetime
-    dt = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    from itertools import combinations
-    combos = []
-    for n in range(2, nrobots+1):
-        combos.extend(combinations(robots, n))
-    import sys
-    py = sys.executable
-    main = os.path.abspath(__file__)
-    cmd = '%s %s -t "%s" -g -n %s --robots %s'
-    for combo in combos:
-        rstr = ' '.join(combo)
-        cmdstr = cmd % (py, main, dt, nbattles, rstr)
-        print cmdstr
-        os.system(cmdstr)
+def setup_console_logging(level):
+    '''Show battle events (hits, explosions, etc.) on the console
+        if they are at least as important as level.
+    '''
+
+    import logging
+    logger = logging.getLogger('PybotwarLogger')
+    level = logging.getLevelName(level.upper())
+    if not logger.level or logger.level > level:
+        # Messages below this level are dropped before being formatted
+        logger.setLevel(level)
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setLevel(level)
+    logger.addHandler(handler)
+
+def run_supertournament(nbattles, jobs=1, resume=None,
+                            sample=None, sample_seed=None, seed=None):
+    if resume is None:
+        robots = conf.robots
+        nrobots = len(robots)
+        import datetime
+        dt = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        if sample is not None:
+            import random
+            import tournament
+            if sample_seed is None:
+                sample_seed = random.randrange(1000000)
+            print 'Sampling %s lineups with seed %s' % (sample, sample_seed)
+            combos = tournament.sample_lineups(robots, sample, sample_seed)
+        else:
+            from itertools import combinations
+            combos = []
+            for n in range(2, nrobots+1):
+                combos.extend(combinations(robots, n))
+        lineups = []
+        for combo in combos:
+            lineups.extend([combo] * nbattles)
+        stats.add_jobs(dt, lineups, seed)
+        print 'Beginning supertournament', dt
+    else:
+        dt = resume
+        print 'Resuming supertournament', dt
+
+    pending = stats.pending_jobs(dt)
+    if not pending:
+        print 'No battles left to run.'
+        return
+
+    battles = [(lineup, dt, False, job, jobseed)
+                    for job, lineup, jobseed in pending]
+    print '%s battles to run.' % len(battles)
+    import tournament
+    tournament.run_battles(battles, jobs)
+    tournament.print_results(dt, stats.count_jobs(dt))
 
 if __name__ == '__main__':
     import sys
@@ -120,6 +156,21 @@ if __name__ == '__main__':
     parser.add_argument('--supertournament', dest='supertournament',
                     action='store_true', default=False,
                     help='run a supertournament')
+    parser.add_argument('--resume', dest='resume',
+                    metavar='DT',
+                    help='continue an unfinished supertournament')
+    parser.add_argument('--sample', dest='sample',
+                    action='store', type=int, metavar='N',
+                    help='run only N lineups in the supertournament')
+    parser.add_argument('--sample-seed', dest='sample_seed',
+                    action='store', type=int, metavar='SEED',
+                    help='random seed for choosing the sample lineups')
+    parser.add_argument('--seed', dest='seed',
+                    action='store', type=int,
+                    help='random seed for the (first) battle')
+    parser.add_argument('-j', '--jobs', dest='jobs',
+                    action='store', type=int, default=1,
+                    help='number of battles to run at once in tournaments')
     parser.add_argument('-g', '--no-graphics', dest='nographics',
                     action='store_true', default=False,
                     help='non graphics mode')
@@ -138,6 +189,21 @@ if __name__ == '__main__':
     parser.add_argument('-B', '--app-debug', dest='appdebug',
                     action='store_true', default=False,
                     help='enable app debug log')
+    parser.add_argument('--turbo', dest='turbo',
+                    action='store_true', default=False,
+                    help='do not show battle events (fastest)')
+    parser.add_argument('--record', dest='record',
+                    action='store_true', default=False,
+                    help='save battles to replay files')
+    parser.add_argument('--profile', dest='profile',
+                    action='store_true', default=False,
+                    help='time each phase of the battle and report')
+    parser.add_argument('--think-times', dest='think_times',
+                    action='store_true', default=False,
+                    help='report the time robots spend thinking')
+    parser.add_argument('--replay', dest='replay',
+                    metavar='FILE',
+                    help='show a saved replay file (use with -P)')
     parser.add_argument('--robots', dest='robots', nargs='+',
                     metavar='ROBOT',
                     help='list of robots to load')
@@ -148,22 +214,46 @@ if __name__ == '__main__':
     tournament = options.tournament
     nbattles = options.nbattles
     supertournament = options.supertournament
+    resume = options.resume
+    sample = options.sample
+    sample_seed = options.sample_seed
+    jobs = options.jobs
+    seed = options.seed
     nographics = options.nographics
     pyqtgraphics = options.pyqtgraphics
     pygseargraphics = options.pygseargraphics
     upgrade_db = options.upgrade_db
     qtreset = options.qtreset
     appdebug = options.appdebug
+    turbo = options.turbo
+    record = options.record
+    profile = options.profile
+    think_times = options.think_times
+    replayfile = options.replay
     robots = options.robots
 
     if robots is not None:
         conf.robots = robots
 
+    if record:
+        conf.record_replays = True
+
+    if profile:
+        conf.profile = True
+
+    if think_times:
+        conf.think_times = True
+
     gmodes = nographics + pyqtgraphics + pygseargraphics
 
     if appdebug:
         setup_logging()
 
+    if turbo:
+        setup_console_logging(conf.turbo_log_level)
+    else:
+        setup_console_logging(conf.console_log_level)
+
     if gmodes > 1:
         print 'must select ONE of -g, -Q, or -P'
         import sys
@@ -173,12 +263,20 @@ if __name__ == '__main__':
         print 'must select one of --tournament or --supertournament'
         import sys
         sys.exit(0)
-    elif supertournament:
-        run_supertournament(nbattles)
+    elif resume and not supertournament:
+        print '--resume only works with --supertournament'
         import sys
         sys.exit(0)
-
-    elif nographics:
+    elif sample is not None and (not supertournament or resume):
+        print '--sample only works when starting a --supertournament'
+        import sys
+        sys.exit(0)
+    elif jobs > 1 and not (supertournament or nographics):
+        # Battles in other processes cannot be shown
+        print '-j only works with -g or --supertournament'
+        import sys
+        sys.exit(0)
+    elif supertournament or nographics:
         viewselect.select_view_module('none')
     elif pyqtgraphics:
         viewselect.select_view_module('pyqt')
@@ -218,6 +316,19 @@ def reset_qt_settings():
     sys.exit(0)
 
 
+def play_replay(path):
+    import replay
+    if pygseargraphics:
+        w = world.World()
+        player = replay.Player(path, w.v)
+        while player.step() and not w.v.quit:
+            pass
+    else:
+        if pyqtgraphics:
+            print 'Replays can only be shown with the Pygsear interface (-P)'
+        replay.summary(path)
+
+
 def runmain():
     if qtreset:
         reset_qt_settings()
@@ -230,12 +341,23 @@ def runmain():
         stats.dbopen()
         return
 
+    if replayfile is not None:
+        play_replay(replayfile)
+        return
+
     dbcheck()
 
     stats.dbopen()
 
     global tournament
     global nbattles
+
+    if supertournament:
+        run_supertournament(nbattles, jobs, resume, sample, sample_seed,
+                                seed)
+        stats.dbclose()
+        return
+
     if not pyqtgraphics and not tournament:
         tournament = True
         nbattles = 1
@@ -250,27 +372,15 @@ def runmain():
         else:
             dt = tournament
         print 'Beginning tournament with %s battles.' % nbattles
-        for battle in range(nbattles):
-            print 'Battle', battle+1
-            game = Game(testmode, dt)
-            game.run()
-            world.Robot.nrobots = 0
-            view.Robot.nrobots = 0
-
-        results = stats.tournament_results(dt)
-        print;print;print;
-        print 'Tournament Results'
-        print nbattles, 'battles between', len(results), 'robots'
-        print
-        for line in results:
-            print line[1], ':', line[4], 'wins', ':', line[6], 'outlasted', ':', line[7], 'dmg caused', ':', line[8], 'kills'
+        from tournament import run_tournament
+        run_tournament(dt, nbattles, jobs, testmode, seed)
 
     elif pyqtgraphics:
         import qt4view
         qt4view.run(testmode)
 
     else:
-        game = Game(testmode)
+        game = Game(testmode, seed=seed)
         game.run()
 
     stats.dbclose()
@@ -30,6 +30,12 @@ class Fake(object):
     def kill(self):
         pass
 
+    def hide(self):
+        pass
+
+    def show(self):
+        pass
+
     def step(self, n=None):
         pass
 
@@ -122,6 +122,13 @@ class Bullet(Square):
         x, y = trans(pos)
         self.set_position(x, y)
 
+    def hide(self):
+        self._groups = self.groups()
+        self.kill()
+
+    def show(self):
+        self.add(*self._groups)
+
 class Explosion(Circle):
     def __init__(self, pos):
         r = conf.explosion_radii[-1] # largest explosion radius
@@ -0,0 +1,134 @@
+# Copyright 2009-2014 Lee Harr
+#
+# This file is part of pybotwar.
+#     http://pybotwar.googlecode.com/
+#
+# Pybotwar is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pybotwar is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Pybotwar.  If not, see <http://www.gnu.org/licenses/>.
+
+
+'''Keep robot processes alive between battles.
+
+Starting a new Python process for every robot in every battle
+    takes a large part of the time of a short battle. A WorkerPool
+    starts control.py processes ahead of time and hands them out to
+    the game. Each one loads a new robot when it is handed out, and
+    goes back in to the pool when the battle finishes normally.
+
+Processes for robots that were removed from a battle (for errors,
+    timeouts, or being destroyed) are killed instead of reused.
+
+'''
+
+
+import subprocess
+from subprocess import PIPE
+
+import protocol
+import conf
+
+
+class WorkerPool(object):
+    def __init__(self, size=0):
+        self.idle = []
+        for n in range(size):
+            proc = self.spawn()
+            if proc is not None:
+                self.idle.append(proc)
+
+    def spawn(self):
+        'Start a new worker process. Returns None if it does not start.'
+
+        proc = subprocess.Popen([conf.subproc_python,
+                                    conf.subproc_main,
+                                    protocol.POOL],
+                                    stdin=PIPE, stdout=PIPE)
+        if self.ready(proc):
+            return proc
+        else:
+            self.discard(proc)
+            return None
+
+    def ready(self, proc):
+        'Return True if the worker reports that it is ready for a robot.'
+
+        try:
+            line = proc.stdout.readline().strip()
+        except IOError:
+            return False
+
+        return line == protocol.READY
+
+    def launch(self, robot, rfile, robotname, testmode):
+        '''Have a worker load the robot.
+
+        Returns the worker process, which will report START or ERROR
+            the same as a newly started robot process.
+
+        '''
+
+        line = protocol.format_reset(robot, rfile, robotname, testmode)
+
+        while self.idle:
+            proc = self.idle.pop()
+            if proc.poll() is not None:
+                continue
+            try:
+                proc.stdin.write(line)
+                proc.stdin.flush()
+            except IOError:
+                self.discard(proc)
+                continue
+            return proc
+
+        proc = self.spawn()
+        if proc is not None:
+            proc.stdin.write(line)
+            proc.stdin.flush()
+        return proc
+
+    def release(self, proc):
+        '''Take back a worker after its robot is finished.
+
+        FINISH must already have been sent. If the worker does not
+            report READY it is not used again.
+
+        '''
+
+        if self.ready(proc):
+            self.idle.append(proc)
+        else:
+            self.discard(proc)
+
+    def discard(self, proc):
+        'Kill a worker that is not going back in to the pool.'
+
+        try:
+            proc.stdin.close()
+            proc.stdout.close()
+            proc.kill()
+        except (IOError, OSError):
+            pass
+        proc.wait()
+
+    def close(self):
+        'Shut down all idle workers.'
+
+        while self.idle:
+            proc = self.idle.pop()
+            try:
+                proc.stdin.close()
+            except IOError:
+                pass
+            proc.stdout.close()
+            proc.wait()
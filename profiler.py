@@ -0,0 +1,259 @@
+# Copyright 2009-2014 Lee Harr
+#
+# This file is part of pybotwar.
+#     http://pybotwar.googlecode.com/
+#
+# Pybotwar is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pybotwar is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Pybotwar.  If not, see <http://www.gnu.org/licenses/>.
+
+
+'''Find out where the time goes in a battle.
+
+When profiling is on (conf.profile, or the --profile option) the game
+    keeps a Profiler and adds the time spent in each phase of each
+    tick. The phases are:
+
+    sensors -- making the sensor line for a robot
+    write -- writing the sensor line to the robot's pipe
+    wait -- waiting for the robot's reply (for the binary protocol,
+        this includes reading the commands too)
+    parse -- turning the reply in to commands
+    apply -- carrying out the commands in the world
+    pings -- casting the radar beams of all robots that pinged
+    record -- writing the replay file
+    physics -- the pybox2d world step
+    destroy -- removing dead robots and spent bullets
+    update -- cooling cannons, burning bullet fuses and explosions
+    showit -- moving the view items to match the bodies
+    view -- updating the view itself
+
+The robot phases (sensors to apply) are also kept per robot. With
+    concurrent_ticks, the robots wait at the same time, so the
+    per-robot wait is how long after its line was sent the reply
+    was read, and those do not add up to the total wait.
+
+At the end of the battle, the summary is printed and a CSV file is
+    written to the profile_dir.
+
+'''
+
+
+import os
+import time
+import bisect
+from collections import defaultdict
+
+import conf
+
+
+clock = time.time
+
+phases = ['sensors', 'write', 'wait', 'parse', 'apply', 'pings', 'record',
+            'physics', 'destroy', 'update', 'showit', 'view']
+robot_phases = ['sensors', 'write', 'wait', 'parse', 'apply']
+
+# Think time histogram buckets, as fractions of the tick_timeout
+think_buckets = [0.1, 0.25, 0.5, 0.75, 0.9, 1.0]
+think_labels = ['<%d%%' % (100 * b) for b in think_buckets] + ['>=100%']
+
+
+class Profiler(object):
+    def __init__(self):
+        self.ticks = 0
+        self.tick_time = 0.0 # total time in Game.tick
+        self.totals = defaultdict(float) # phase -> seconds
+        self.calls = defaultdict(int) # phase -> number of times timed
+        self.robots = defaultdict(lambda: defaultdict(float))
+        self.robot_calls = defaultdict(lambda: defaultdict(int))
+
+    def add(self, phase, seconds, robotname=None, total=True):
+        '''Count seconds spent in the phase, for the robot if
+            robotname is given.
+
+        If total is False, the time only counts for the robot and
+            not in the totals.
+
+        '''
+
+        if total:
+            self.totals[phase] += seconds
+            self.calls[phase] += 1
+        if robotname is not None:
+            self.robots[robotname][phase] += seconds
+            self.robot_calls[robotname][phase] += 1
+
+    def lap(self, phase, t0, robotname=None):
+        '''Count the time since t0 in the phase.
+
+        Returns the time now, to start timing the next phase.
+
+        '''
+
+        t = clock()
+        self.add(phase, t - t0, robotname)
+        return t
+
+    def tick(self, seconds):
+        'Count one whole tick.'
+
+        self.ticks += 1
+        self.tick_time += seconds
+
+    def report(self):
+        'Print the summary tables.'
+
+        ticks = max(self.ticks, 1)
+        tick_time = self.tick_time or 1
+
+        print
+        print 'PROFILE: %s ticks, %.3f seconds (%.3f ms per tick)' % (
+                    self.ticks, self.tick_time, 1000 * self.tick_time / ticks)
+        print '%-10s %10s %10s %7s' % ('phase', 'seconds', 'ms/tick', '%')
+        counted = 0
+        for phase in phases:
+            seconds = self.totals.get(phase, 0)
+            counted += seconds
+            print '%-10s %10.3f %10.3f %6.1f%%' % (phase, seconds,
+                        1000 * seconds / ticks, 100 * seconds / tick_time)
+        other = max(self.tick_time - counted, 0)
+        print '%-10s %10.3f %10.3f %6.1f%%' % ('other', other,
+                    1000 * other / ticks, 100 * other / tick_time)
+
+        if self.robots:
+            print
+            print 'ms per tick by robot:'
+            print '%-20s' % 'robot' + ''.join('%9s' % phase
+                                                for phase in robot_phases)
+            for robotname in sorted(self.robots):
+                times = self.robots[robotname]
+                print '%-20s' % robotname[:20] + ''.join(
+                        '%9.3f' % (1000 * times.get(phase, 0) / ticks)
+                            for phase in robot_phases)
+        print
+
+    def write_csv(self, path):
+        '''Write all of the timings to a CSV file, one row for each
+            phase and robot. Totals have an empty robot column.
+        '''
+
+        d = os.path.dirname(path)
+        if d and not os.path.exists(d):
+            os.makedirs(d)
+
+        import csv
+        f = open(path, 'wb')
+        writer = csv.writer(f)
+        writer.writerow(['robot', 'phase', 'seconds', 'calls',
+                            'ms_per_tick'])
+        ticks = max(self.ticks, 1)
+        writer.writerow(['', 'tick', '%.6f' % self.tick_time, self.ticks,
+                            '%.4f' % (1000 * self.tick_time / ticks)])
+        for phase in phases:
+            seconds = self.totals.get(phase, 0)
+            writer.writerow(['', phase, '%.6f' % seconds,
+                                self.calls.get(phase, 0),
+                                '%.4f' % (1000 * seconds / ticks)])
+        for robotname in sorted(self.robots):
+            times = self.robots[robotname]
+            calls = self.robot_calls[robotname]
+            for phase in robot_phases:
+                seconds = times.get(phase, 0)
+                writer.writerow([robotname, phase, '%.6f' % seconds,
+                                    calls.get(phase, 0),
+                                    '%.4f' % (1000 * seconds / ticks)])
+        f.close()
+
+
+class ThinkTime(object):
+    '''Time one robot spent in respond(), as reported by the robot.
+
+    Keeps totals and a histogram of the wall clock time per tick,
+        in think_buckets. Robots that often land near 100% are about
+        to start timing out.
+
+    '''
+
+    def __init__(self):
+        self.ticks = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.maxwall = 0.0
+        self.histogram = [0] * len(think_labels)
+
+    def add(self, wall, cpu, ticks=1):
+        '''Count wall and cpu seconds spent on ticks ticks (more than
+            one if the robot sent a plan).
+        '''
+
+        if not ticks:
+            return
+
+        self.ticks += ticks
+        self.wall += wall
+        self.cpu += cpu
+
+        each = wall / ticks
+        self.maxwall = max(self.maxwall, each)
+
+        limit = conf.tick_timeout
+        bucket = bisect.bisect_right([b * limit for b in think_buckets], each)
+        self.histogram[bucket] += ticks
+
+    def add_timeout(self):
+        '''Count a tick where the robot ran out of time. The robot
+            cannot say how long it took, so count it as taking the
+            whole tick_timeout.
+        '''
+
+        limit = conf.tick_timeout
+        self.ticks += 1
+        self.wall += limit
+        self.maxwall = max(self.maxwall, limit)
+        self.histogram[-1] += 1
+
+    def summary(self):
+        '''Return the tuple (ticks, wall, cpu, maxwall, histogram),
+            with all times in seconds.
+        '''
+
+        return (self.ticks, self.wall, self.cpu, self.maxwall,
+                    list(self.histogram))
+
+    def describe(self):
+        'Return a short line of text about the average and worst times.'
+
+        ticks = max(self.ticks, 1)
+        return 'wall %.2f ms (max %.2f)  cpu %.2f ms' % (
+                    1000 * self.wall / ticks, 1000 * self.maxwall,
+                    1000 * self.cpu / ticks)
+
+    def describe_histogram(self):
+        'Return a short line of text with the histogram of wall times.'
+
+        return '  '.join('%s:%s' % (label, n) for label, n
+                            in zip(think_labels, self.histogram))
+
+
+def profile_dir():
+    return os.path.join(conf.base_dir, conf.profile_dir)
+
+_nfiles = 0
+def new_profile_path():
+    'Return a path for a new profile file that no other battle will use.'
+
+    global _nfiles
+    _nfiles += 1
+
+    stamp = time.strftime('%Y%m%d-%H%M%S')
+    fname = '%s-%s-%s.csv' % (stamp, os.getpid(), _nfiles)
+    return os.path.join(profile_dir(), fname)
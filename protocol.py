@@ -0,0 +1,388 @@
+# Copyright 2009-2014 Lee Harr
+#
+# This file is part of pybotwar.
+#     http://pybotwar.googlecode.com/
+#
+# Pybotwar is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pybotwar is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Pybotwar.  If not, see <http://www.gnu.org/licenses/>.
+
+
+'''Messages passed between the game and the robot processes.
+
+The text protocol is the default. Each tick the game sends a line
+    of sensor data and the robot answers with a line of commands.
+
+The binary protocol sends the same values packed in to fixed-size
+    records. It is requested by the game right after the robot
+    process reports START by sending the line in PROTOCOL_BINARY.
+    If the robot process answers with the same line, both sides
+    switch to binary messages for the rest of the battle.
+
+Robot processes started from the worker pool (see pool.py) stay
+    alive between battles. The process reports READY and the game
+    sends a RESET line naming the robot to load. From there on it is
+    the same as a robot process started for one battle, until FINISH.
+    Then the process reports READY again.
+
+Batch ticks are requested the same way, with the line in BATCH.
+    The robot may then answer a tick with a plan: the commands for
+    several ticks in a row. The game uses the plan without asking
+    the robot again until the plan runs out or something important
+    happens to the robot.
+
+Think times are requested the same way, with the line in TIMING.
+    Each reply holding commands then ends with the wall clock and
+    CPU time the robot spent in respond() for those commands. In
+    the text protocol that is a trailing field after TIMES_SEPARATOR,
+    and in the binary protocol a TIMES record after the commands.
+
+'''
+
+
+import struct
+
+from util import defaultNonedict
+
+
+PROTOCOL_BINARY = 'PROTOCOL:BINARY'
+BATCH = 'BATCH:%s'
+MAX_BATCH = 255 # the binary PLAN count is one byte
+TIMING = 'TIMING'
+
+# Worker pool
+POOL = 'POOL' # command line argument to start control.py as a pool worker
+READY = 'READY'
+RESET_LINE = 'RESET:%s|%s|%s|%s\n'
+
+def format_reset(modname, rfile, robotname, testmode):
+    'Return the line asking a pool worker to load a new robot.'
+
+    return RESET_LINE % (modname, rfile, robotname, int(testmode))
+
+def parse_reset(line):
+    '''Return the tuple (modname, rfile, robotname, testmode) from
+        a RESET line, or None if the line is not a RESET line.
+    '''
+
+    if not line.startswith('RESET:'):
+        return None
+
+    try:
+        modname, rfile, robotname, testmode = line[6:].split('|')
+        testmode = bool(int(testmode))
+    except ValueError:
+        return None
+
+    return modname, rfile, robotname, testmode
+
+
+# Text protocol
+
+SENSORS_LINE = 'TICK:%s|HEALTH:%s|POS:%s;%s|TUR:%s|PING:%s;%s;%s|GYRO:%s|HEAT:%s|LOADING:%s|PINGED:%s\n'
+COMMANDS_LINE = 'FORCE:%s|TORQUE:%s|FIRE:%s|PING:%s|TURRET:%s'
+PLAN_SEPARATOR = '&'
+TIMES_SEPARATOR = '#'
+
+def format_sensors(sensors):
+    '''Given the tuple of sensor values
+        (tick, health, x, y, turret, pingtype, pingangle, pingdist,
+            gyro, heat, loading, pinged)
+        return the text line to send to the robot.
+    '''
+
+    return SENSORS_LINE % sensors
+
+def parse_sensors(line):
+    'Return the sensors dictionary for the robot from a text line.'
+
+    data = line.split('|')
+    sensors = defaultNonedict()
+    for d in data:
+        k, v = d.split(':')
+
+        if ';' in v:
+            # Some sensors send multiple values, separated by semicolon
+            v = v.split(';')
+            vconv = []
+            for vv in v:
+                try:
+                    vvconv = int(vv)
+                except:
+                    vvconv = vv
+
+                vconv.append(vvconv)
+
+        else:
+            try:
+                vconv = int(v)
+            except:
+                vconv = v
+
+        sensors[k] = vconv
+
+    return sensors
+
+def format_commands(commands):
+    '''Given the tuple of commands (force, torque, fire, ping, turret)
+        return the text reply for the game.
+    '''
+
+    return COMMANDS_LINE % commands
+
+def format_plan(plan):
+    'Return the text reply for a list of command tuples.'
+
+    return PLAN_SEPARATOR.join(COMMANDS_LINE % commands for commands in plan)
+
+def format_times(wall, cpu):
+    '''Return the trailing field for a text reply, given the wall
+        and CPU time in seconds.
+    '''
+
+    return '%s%d;%d' % (TIMES_SEPARATOR, wall * 1000000, cpu * 1000000)
+
+def split_times(line):
+    '''Return the tuple (line, times) where line is the text reply
+        without the trailing times field, and times is the tuple
+        (wall, cpu) in seconds, or None if there was no times field.
+    '''
+
+    if TIMES_SEPARATOR not in line:
+        return line, None
+
+    line, field = line.rsplit(TIMES_SEPARATOR, 1)
+    try:
+        wall, cpu = field.split(';')
+        times = int(wall) / 1000000.0, int(cpu) / 1000000.0
+    except ValueError:
+        times = None
+
+    return line, times
+
+def parse_plan(line):
+    '''Return the list of commands dictionaries from a text reply
+        line, or None if the line does not hold commands.
+    '''
+
+    plan = []
+    for part in line.split(PLAN_SEPARATOR):
+        commands = parse_commands(part)
+        if commands is None:
+            return None
+        plan.append(commands)
+
+    return plan
+
+def parse_commands(line):
+    '''Return the commands dictionary from a text reply line,
+        or None if the line does not hold commands.
+    '''
+
+    commands = {}
+    try:
+        props = line.split('|')
+        for prop in props:
+            kind, val = prop.split(':')
+            try:
+                vconv = int(val)
+            except ValueError:
+                pass
+            else:
+                val = vconv
+            commands[kind] = val
+    except ValueError:
+        return None
+
+    return commands
+
+
+# Binary protocol
+
+# game -> robot
+TICK = 'T'
+DEBUG = 'D'
+NODEBUG = 'd'
+FINISH = 'F'
+
+# tick, health, x, y, turret, pingtype, pingangle, pingdist,
+#   gyro, heat, loading, pinged
+SENSORS = struct.Struct('<ihhhhchhhhhB')
+
+# robot -> game
+COMMANDS = 'C'
+PLAN = 'P' # followed by a count byte, then that many commands records
+STATUS = {
+    'TIMEOUT': 't',
+    'ERROR': 'e',
+    'END': 'n',
+    'LOG': 'l',
+    'NOLOG': 'o',
+}
+STATUS_WORDS = dict((v, k) for k, v in STATUS.items())
+
+# force, torque, fire kind ('_', 'X', or 'D' for distance),
+#   fire distance, ping, turret
+COMMANDS_RECORD = struct.Struct('<iiciBi')
+
+# The game clamps force, torque and turret to this, so clamping them
+#   before packing gives the same result as the text protocol
+COMMAND_LIMIT = 100
+INT_MIN, INT_MAX = -2**31, 2**31 - 1
+
+# wall, cpu (microseconds)
+TIMES = struct.Struct('<II')
+
+def pack_sensors(sensors):
+    'Return the binary tick message for the tuple of sensor values.'
+
+    return TICK + SENSORS.pack(*sensors)
+
+def unpack_sensors(data):
+    '''Return the sensors dictionary for the robot from a binary
+        tick message (without the leading TICK byte).
+    '''
+
+    return sensors_dict(SENSORS.unpack(data))
+
+def sensors_dict(values):
+    'Return the sensors dictionary for the robot from the tuple of values.'
+
+    (tick, health, x, y, tur, pingtype, pingangle, pingdist,
+        gyro, heat, loading, pinged) = values
+
+    sensors = defaultNonedict()
+    sensors['TICK'] = tick
+    sensors['HEALTH'] = health
+    sensors['POS'] = [x, y]
+    sensors['TUR'] = tur
+    sensors['PING'] = [pingtype, pingangle, pingdist]
+    sensors['GYRO'] = gyro
+    sensors['HEAT'] = heat
+    sensors['LOADING'] = loading
+    sensors['PINGED'] = pinged
+
+    return sensors
+
+def pack_commands(force, torque, fire, ping, turret):
+    'Return the binary reply message holding the robot commands.'
+
+    return COMMANDS + pack_record(force, torque, fire, ping, turret)
+
+def pack_plan(plan):
+    'Return the binary reply message for a list of command tuples.'
+
+    if len(plan) == 1:
+        return pack_commands(*plan[0])
+
+    records = [pack_record(*commands) for commands in plan]
+    return PLAN + chr(len(records)) + ''.join(records)
+
+def clamp(n, low, high):
+    return max(low, min(n, high))
+
+def pack_record(force, torque, fire, ping, turret):
+    '''Return one binary commands record.
+
+    Values out of range for the record are clamped. Values that are
+        not numbers raise ValueError or TypeError.
+
+    '''
+
+    if fire == '_' or fire == 'X':
+        firekind, firedist = fire, 0
+    else:
+        firekind, firedist = 'D', clamp(int(fire), INT_MIN, INT_MAX)
+
+    limit = COMMAND_LIMIT
+    return COMMANDS_RECORD.pack(clamp(int(force), -limit, limit),
+                                    clamp(int(torque), -limit, limit),
+                                    firekind, firedist, int(bool(ping)),
+                                    clamp(int(turret), -limit, limit))
+
+def pack_times(wall, cpu):
+    'Return the binary TIMES record, given the wall and CPU time in seconds.'
+
+    return TIMES.pack(int(wall * 1000000), int(cpu * 1000000))
+
+def read_times(f):
+    '''Read one TIMES record from file f.
+
+    Returns the tuple (wall, cpu) in seconds, or None.
+
+    '''
+
+    data = f.read(TIMES.size)
+    if len(data) != TIMES.size:
+        return None
+
+    wall, cpu = TIMES.unpack(data)
+    return wall / 1000000.0, cpu / 1000000.0
+
+def pack_status(word):
+    'Return the binary reply message for TIMEOUT, ERROR, END, etc.'
+
+    return STATUS[word]
+
+def read_reply(f):
+    '''Read one binary reply message from file f.
+
+    Returns a tuple (result, plan) where result is the status
+        word ('TIMEOUT', 'END', etc.) or '' if the reply holds
+        commands, and plan is the list of commands dictionaries
+        or None.
+
+    '''
+
+    kind = f.read(1)
+    if kind == COMMANDS:
+        count = 1
+    elif kind == PLAN:
+        count = ord(f.read(1) or '\0')
+    else:
+        return STATUS_WORDS.get(kind, ''), None
+
+    size = COMMANDS_RECORD.size
+    data = f.read(count * size)
+    if not count or len(data) != count * size:
+        return '', None
+
+    plan = []
+    for n in range(count):
+        record = data[n*size:(n+1)*size]
+        plan.append(unpack_record(record))
+
+    return '', plan
+
+def unpack_record(record):
+    'Return the commands dictionary for one binary commands record.'
+
+    force, torque, firekind, firedist, ping, turret = COMMANDS_RECORD.unpack(record)
+    if firekind == 'D':
+        fire = firedist
+    else:
+        fire = firekind
+
+    return commands_dict(force, torque, fire, ping, turret)
+
+def commands_dict(force, torque, fire, ping, turret):
+    'Return the commands dictionary for the game from the command values.'
+
+    commands = {
+        'FORCE': force,
+        'TORQUE': torque,
+        'FIRE': fire,
+        'PING': ping,
+        'TURRET': turret,
+    }
+
+    return commands
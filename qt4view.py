@@ -21,6 +21,7 @@ import os
 import sys
 import math
 pi = math.pi
+import time
 
 import logging
 logger = logging.getLogger('PybotwarLogger')
@@ -41,6 +42,8 @@ uifile = 'mainwindow.ui'
 uipath = os.path.join(uidir, uifile)
 MWClass, _ = uic.loadUiType(uipath)
 
+speeds = [1, 2, 4, 8] # Choices for the Speed menu (times real time)
+
 
 class MainWindow(QtGui.QMainWindow):
     def __init__(self, app, testmode):
@@ -49,6 +52,10 @@ class MainWindow(QtGui.QMainWindow):
         self.paused = False
         self._tournament = None
 
+        self.speed = 1
+        self._lastframe = time.time()
+        self._simtime = 0 # seconds of battle waiting to be simulated
+
         QtGui.QMainWindow.__init__(self)
         self.ui = MWClass()
         self.ui.setupUi(self)
@@ -73,6 +80,7 @@ class MainWindow(QtGui.QMainWindow):
         self._fdir = None
 
         self.setup_settings()
+        self.setup_speed_menu()
 
         # Call resize a bit later or else view will not resize properly
         self._initialresize = True
@@ -131,10 +139,33 @@ class MainWindow(QtGui.QMainWindow):
             self.update_debug_robot()
 
     def timerEvent(self, ev):
-        if not self.paused:
-            self.game.tick()
-            if self.debug_robot is not None:
-                self.update_debug_robot()
+        '''Run as many ticks as fit in the time since the last frame
+            at the chosen speed, then draw the arena once.
+
+        If the game cannot keep up, ticks are skipped instead of
+            running later to catch up.
+
+        '''
+
+        now = time.time()
+        elapsed = now - self._lastframe
+        self._lastframe = now
+
+        if self.paused:
+            self._simtime = 0
+            return
+
+        self._simtime += elapsed * self.speed
+        nticks = int(self._simtime * 60)
+        self._simtime -= nticks / 60.0
+
+        maxticks = 2 * self.speed
+        if nticks > maxticks:
+            nticks = maxticks
+            self._simtime = 0
+
+        for n in range(nticks):
+            self.game.tick(render=(n == nticks-1))
 
             if not self.game.rnd % 60:
                 remaining = conf.maxtime - (self.game.rnd / 60)
@@ -143,7 +174,13 @@ class MainWindow(QtGui.QMainWindow):
             if (self.game.rnd > 60 * conf.maxtime or
                     len(self.game.procs) <= 1):
                 if not self.testmode:
+                    if n < nticks-1:
+                        self.game.w.showit()
                     self.battle_over()
+                    break
+
+        if nticks and self.debug_robot is not None:
+            self.update_debug_robot()
 
     def battle_over(self):
         self.pauseBattle(True)
@@ -345,6 +382,21 @@ class MainWindow(QtGui.QMainWindow):
     def setup_settings(self):
         self._fdir = conf.base_dir
 
+    def setup_speed_menu(self):
+        menu = QtGui.QMenu('S&peed', self.ui.menubar)
+        self.ui.menubar.insertMenu(self.ui.menuHelp.menuAction(), menu)
+        self.speedgroup = QtGui.QActionGroup(menu)
+        self.speedgroup.triggered.connect(self.choose_speed)
+        for speed in speeds:
+            ac = QtGui.QAction('%sx' % speed, self.speedgroup)
+            ac.setCheckable(True)
+            ac.setChecked(speed == self.speed)
+            menu.addAction(ac)
+
+    def choose_speed(self):
+        speed = str(self.speedgroup.checkedAction().text())
+        self.speed = int(speed.rstrip('x'))
+
     def enable_debug(self):
         if self.ui.actionEnableDebug.isChecked():
             self.game.enable_debug()
@@ -417,6 +469,11 @@ class MainWindow(QtGui.QMainWindow):
         pinged = str(model._pinged == game.rnd - 1)
         window.pinged.setText(pinged)
 
+        thinktime = game.thinktimes.get(self.debug_robot)
+        if thinktime is not None and thinktime.ticks:
+            window.thinktime.setText(thinktime.describe())
+            window.thinkhist.setText(thinktime.describe_histogram())
+
         for kind in [
                 'FORCE',
                 'TORQUE',
@@ -0,0 +1,499 @@
+# Copyright 2009-2014 Lee Harr
+#
+# This file is part of pybotwar.
+#     http://pybotwar.googlecode.com/
+#
+# Pybotwar is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pybotwar is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Pybotwar.  If not, see <http://www.gnu.org/licenses/>.
+
+
+'''Record battles to replay files, and play them back.
+
+A replay file starts with the MAGIC line. Everything after that is
+    one zlib stream holding the list of robots, then one frame per
+    tick.
+
+Each frame holds, for every robot still in the battle, its position,
+    angle, turret angle, health and commands, and for every bullet,
+    its position and explosion state. Positions are stored in
+    centimeters and angles in 1/4096 of a turn, as whole numbers.
+
+Every KEYFRAME ticks the frame holds the full values. Frames in
+    between hold only the change from the frame before, which is
+    usually 0 or close to it. Numbers are written as variable length
+    integers, so small changes take a single byte, and then zlib
+    squeezes out the long runs of zeros.
+
+'''
+
+
+import os
+import zlib
+import time
+from math import pi
+
+import conf
+
+
+MAGIC = 'PYBOTWAR REPLAY 1\n'
+KEYFRAME = 300 # ticks between full frames (5 seconds)
+
+ANGLE_STEPS = 4096 # angles are stored in 1/ANGLE_STEPS of a turn
+
+_nfiles = 0 # replay files started by this process
+
+
+# Numbers in the stream
+
+def zigzag(n):
+    'Map signed n to unsigned: 0, -1, 1, -2, ... -> 0, 1, 2, 3, ...'
+
+    if n >= 0:
+        return n << 1
+    else:
+        return (-n << 1) - 1
+
+def unzigzag(n):
+    if n & 1:
+        return -((n + 1) >> 1)
+    else:
+        return n >> 1
+
+def write_varint(buf, n):
+    'Append signed integer n to bytearray buf.'
+
+    n = zigzag(n)
+    while n > 0x7f:
+        buf.append((n & 0x7f) | 0x80)
+        n >>= 7
+    buf.append(n)
+
+def read_varint(data, i):
+    '''Read a signed integer from bytearray data at position i.
+
+    Returns the tuple (n, i) with i moved past the number.
+
+    '''
+
+    n = 0
+    shift = 0
+    while True:
+        b = data[i]
+        i += 1
+        n |= (b & 0x7f) << shift
+        if not b & 0x80:
+            return unzigzag(n), i
+        shift += 7
+
+def write_string(buf, s):
+    write_varint(buf, len(s))
+    buf.extend(s)
+
+def read_string(data, i):
+    n, i = read_varint(data, i)
+    return str(data[i:i+n]), i + n
+
+
+# Quantizing
+
+def quantize_pos(v):
+    return int(round(v * 100))
+
+def quantize_angle(a):
+    return int(round(a / (2 * pi) * ANGLE_STEPS)) % ANGLE_STEPS
+
+def angle_delta(a, b):
+    'Return the change from angle b to angle a, taking the short way.'
+
+    d = (a - b) % ANGLE_STEPS
+    if d >= ANGLE_STEPS / 2:
+        d -= ANGLE_STEPS
+    return d
+
+def encode_fire(fire):
+    if fire == '_':
+        return -2
+    elif fire == 'X':
+        return -1
+    else:
+        return int(fire)
+
+def decode_fire(n):
+    if n == -2:
+        return '_'
+    elif n == -1:
+        return 'X'
+    else:
+        return n
+
+
+ROBOT_FIELDS = ['x', 'y', 'angle', 'turret', 'health',
+                    'FORCE', 'TORQUE', 'FIRE', 'PING', 'TURRET']
+ANGLE_FIELDS = [2, 3] # indexes of the fields above that are angles
+
+BULLET_FIELDS = ['x', 'y', 'exploding']
+
+
+def replay_dir():
+    return os.path.join(conf.base_dir, conf.replay_dir)
+
+def new_replay_path():
+    'Return a path for a new replay file that no other battle will use.'
+
+    global _nfiles
+    _nfiles += 1
+
+    stamp = time.strftime('%Y%m%d-%H%M%S')
+    fname = '%s-%s-%s.pbr' % (stamp, os.getpid(), _nfiles)
+    return os.path.join(replay_dir(), fname)
+
+
+class Recorder(object):
+    '''Write the battle in world w to a replay file, one tick at a time.
+
+    robots is a list of (robotname, kind) for the robots in the battle.
+
+    '''
+
+    def __init__(self, path, robots):
+        d = os.path.dirname(path)
+        if d and not os.path.exists(d):
+            os.makedirs(d)
+
+        self.f = open(path, 'wb')
+        self.f.write(MAGIC)
+        self.z = zlib.compressobj()
+
+        self.index = {}
+        buf = bytearray()
+        write_varint(buf, len(robots))
+        for n, (robotname, kind) in enumerate(robots):
+            self.index[robotname] = n
+            write_string(buf, robotname)
+            write_string(buf, kind)
+        self.write(buf)
+
+        self.nframes = 0
+        self.robots = {} # index -> values written last frame
+        self.bullets = {} # bullet id -> values written last frame
+
+    def write(self, buf):
+        self.f.write(self.z.compress(str(buf)))
+
+    def robot_values(self, model):
+        body = model.body
+        pos = body.position
+        commands = getattr(model, '_commands', None) or {}
+
+        return [quantize_pos(pos.x),
+                quantize_pos(pos.y),
+                quantize_angle(body.angle),
+                quantize_angle(model.turretjoint.angle),
+                int(model.health),
+                commands.get('FORCE', 0),
+                commands.get('TORQUE', 0),
+                encode_fire(commands.get('FIRE', '_')),
+                int(bool(commands.get('PING', 0))),
+                commands.get('TURRET', 0)]
+
+    def bullet_values(self, bullet):
+        pos = bullet.body.position
+
+        return [quantize_pos(pos.x),
+                quantize_pos(pos.y),
+                int(bullet._exploding)]
+
+    def record(self, rnd, w):
+        'Add a frame for tick rnd of world w.'
+
+        key = not self.nframes % KEYFRAME
+        self.nframes += 1
+
+        buf = bytearray()
+        if key:
+            buf.append(ord('K'))
+        else:
+            buf.append(ord('D'))
+        write_varint(buf, rnd)
+
+        robots = {}
+        write_varint(buf, len(w.robots))
+        for robotname, model in w.robots.items():
+            n = self.index[robotname]
+            values = self.robot_values(model)
+            robots[n] = values
+            write_varint(buf, n)
+            self.write_values(buf, values, self.robots.get(n), key,
+                                ANGLE_FIELDS)
+        self.robots = robots
+
+        bullets = {}
+        write_varint(buf, len(w.bullets))
+        for bid, bullet in w.bullets.iteritems():
+            values = self.bullet_values(bullet)
+            bullets[bid] = values
+            write_varint(buf, bid)
+            self.write_values(buf, values, self.bullets.get(bid), key)
+        self.bullets = bullets
+
+        self.write(buf)
+
+    def write_values(self, buf, values, last, key, angles=()):
+        if key or last is None:
+            for v in values:
+                write_varint(buf, v)
+        else:
+            for i, v in enumerate(values):
+                if i in angles:
+                    write_varint(buf, angle_delta(v, last[i]))
+                else:
+                    write_varint(buf, v - last[i])
+
+    def close(self):
+        self.f.write(self.z.flush())
+        self.f.close()
+
+
+class Reader(object):
+    'Read the frames of a replay file.'
+
+    def __init__(self, path):
+        f = open(path, 'rb')
+        magic = f.readline()
+        if magic != MAGIC:
+            raise ValueError('%s is not a replay file' % path)
+
+        # Keep whatever can be read, even if recording was cut short
+        z = zlib.decompressobj()
+        self.data = bytearray(z.decompress(f.read()))
+        f.close()
+
+        data = self.data
+        n, i = read_varint(data, 0)
+        self.robots = []
+        for r in range(n):
+            robotname, i = read_string(data, i)
+            kind, i = read_string(data, i)
+            self.robots.append((robotname, kind))
+        self.start = i
+
+    def frames(self):
+        '''Yield one frame per tick as the tuple (rnd, robots, bullets)
+
+        robots is a dictionary robotname -> dictionary of values, with
+            positions in meters and angles in radians.
+
+        bullets is a dictionary bullet id -> dictionary of values.
+
+        '''
+
+        data = self.data
+        i = self.start
+        lastrobots = {}
+        lastbullets = {}
+        while i < len(data):
+            try:
+                kind = chr(data[i])
+                rnd, i = read_varint(data, i+1)
+                key = kind == 'K'
+
+                robots = {}
+                nrobots, i = read_varint(data, i)
+                for r in range(nrobots):
+                    n, i = read_varint(data, i)
+                    values, i = self.read_values(data, i, len(ROBOT_FIELDS),
+                                            lastrobots.get(n), key,
+                                            ANGLE_FIELDS)
+                    robots[n] = values
+
+                bullets = {}
+                nbullets, i = read_varint(data, i)
+                for b in range(nbullets):
+                    bid, i = read_varint(data, i)
+                    values, i = self.read_values(data, i, len(BULLET_FIELDS),
+                                            lastbullets.get(bid), key)
+                    bullets[bid] = values
+
+            except IndexError:
+                # Last frame was not completely written
+                return
+
+            lastrobots = robots
+            lastbullets = bullets
+
+            yield rnd, self.robot_dicts(robots), self.bullet_dicts(bullets)
+
+    def read_values(self, data, i, nvalues, last, key, angles=()):
+        values = []
+        for f in range(nvalues):
+            v, i = read_varint(data, i)
+            values.append(v)
+
+        if not key and last is not None:
+            for f in range(nvalues):
+                values[f] += last[f]
+                if f in angles:
+                    values[f] %= ANGLE_STEPS
+
+        return values, i
+
+    def robot_dicts(self, robots):
+        result = {}
+        for n, values in robots.items():
+            robotname, kind = self.robots[n]
+            d = dict(zip(ROBOT_FIELDS, values))
+            d['kind'] = kind
+            d['x'] /= 100.0
+            d['y'] /= 100.0
+            d['angle'] *= 2 * pi / ANGLE_STEPS
+            d['turret'] *= 2 * pi / ANGLE_STEPS
+            d['FIRE'] = decode_fire(d['FIRE'])
+            result[robotname] = d
+        return result
+
+    def bullet_dicts(self, bullets):
+        result = {}
+        for bid, values in bullets.items():
+            d = dict(zip(BULLET_FIELDS, values))
+            d['x'] /= 100.0
+            d['y'] /= 100.0
+            result[bid] = d
+        return result
+
+
+class Player(object):
+    '''Show a replay using the view items of an arena.
+
+    Call step() once per frame to be drawn. It returns False once
+        the replay has ended.
+
+    '''
+
+    def __init__(self, path, arena):
+        from Box2D import b2Vec2
+        self.vec = b2Vec2
+
+        self.reader = Reader(path)
+        self.frames = self.reader.frames()
+        self.arena = arena
+        self.rnd = 0
+
+        try:
+            self.first = self.frames.next()
+        except StopIteration:
+            self.first = None
+            first = {}
+        else:
+            first = self.first[1]
+
+        # Make the robots in the same order as in the battle, so
+        #   they get the same colors.
+        self.robots = {}
+        self.infos = {}
+        self.health = {}
+        for n, (robotname, kind) in enumerate(self.reader.robots):
+            if robotname in first:
+                d = first[robotname]
+                pos = self.vec(d['x'], d['y'])
+                self.robots[robotname] = arena.addrobot(pos, d['angle'])
+            self.infos[robotname] = arena.addrobotinfo(n+1, robotname)
+            self.health[robotname] = conf.maxhealth
+        self.bullets = {}
+        self.explosions = {}
+
+    def step(self):
+        if self.first is not None:
+            rnd, robots, bullets = self.first
+            self.first = None
+        else:
+            try:
+                rnd, robots, bullets = self.frames.next()
+            except StopIteration:
+                return False
+        self.rnd = rnd
+
+        arena = self.arena
+        vec = self.vec
+
+        for robotname, d in robots.items():
+            pos = vec(d['x'], d['y'])
+            v = self.robots.get(robotname)
+            if v is None:
+                continue
+            v.setpos(pos)
+            v.set_rotation(-d['angle'])
+            v.set_turr_rot(-d['turret'])
+
+            damage = self.health[robotname] - d['health']
+            if damage > 0:
+                self.infos[robotname].health.step(damage)
+                self.health[robotname] = d['health']
+
+        for robotname in self.robots.keys():
+            if robotname not in robots:
+                self.robots.pop(robotname).kill()
+
+        for bid, d in bullets.items():
+            pos = vec(d['x'], d['y'])
+            v = self.bullets.get(bid)
+            if v is None:
+                v = arena.addbullet(pos)
+                self.bullets[bid] = v
+            v.setpos(pos)
+            if d['exploding'] and bid not in self.explosions:
+                self.explosions[bid] = arena.addexplosion(pos)
+
+        for bid in self.bullets.keys():
+            if bid not in bullets:
+                self.bullets.pop(bid).kill()
+                if bid in self.explosions:
+                    self.explosions.pop(bid).kill()
+
+        arena.step()
+
+        return True
+
+
+def summary(path):
+    'Print what happened in the replay file.'
+
+    reader = Reader(path)
+    print 'Replay', path
+    print 'Robots:', ', '.join(name for name, kind in reader.robots)
+
+    nframes = 0
+    shots = {}
+    last = {}
+    for rnd, robots, bullets in reader.frames():
+        nframes += 1
+        for robotname, d in robots.items():
+            if d['FIRE'] != '_':
+                shots[robotname] = shots.get(robotname, 0) + 1
+        last = robots
+
+    print nframes, 'ticks', '(%s seconds)' % (nframes / 60)
+    for robotname, kind in reader.robots:
+        if robotname in last:
+            health = last[robotname]['health']
+        else:
+            health = 0
+        print '   ', robotname, 'health', health, 'shots', shots.get(robotname, 0)
+
+
+if __name__ == '__main__':
+    import sys
+    import util
+    util.setup_conf()
+
+    for path in sys.argv[1:]:
+        summary(path)
@@ -27,6 +27,11 @@ import conf
 
 
 class Robot(object):
+    # Set to True if respond() can be called for several ticks in a
+    #   row with the same sensors (only TICK changes). The game can
+    #   then ask for commands less often (see conf.batch_ticks).
+    plan_ahead = False
+
     def __init__(self, name):
         self._p__name = name
 
@@ -186,8 +191,11 @@ class Robot(object):
     def stop_logging(self):
         self._p__log = False
 
-    @property
-    def response(self):
+    def _p__status(self):
+        '''Return ERROR, LOG, NOLOG, or END if the robot should
+            send that instead of commands, or else None.
+        '''
+
         if self._p__err:
             return 'ERROR'
 
@@ -203,14 +211,21 @@ class Robot(object):
         if self._p__finished:
             return 'END'
         else:
-            r = 'FORCE:%s|TORQUE:%s|FIRE:%s|PING:%s|TURRET:%s' % (self._p__force,
-                                                self._p__torque,
-                                                self._p__fire, self._p__ping,
-                                                self._p__turret_speed)
-            self._p__fire = '_'
-            self._p__ping = 0
-
-            return r
+            return None
+
+    def _p__commands(self):
+        '''Return the tuple (force, torque, fire, ping, turret)
+            of commands for this tick, and clear fire and ping.
+        '''
+
+        c = (self._p__force,
+                self._p__torque,
+                self._p__fire, self._p__ping,
+                self._p__turret_speed)
+        self._p__fire = '_'
+        self._p__ping = 0
+
+        return c
 
     def test005(self):
         sleep(0.005)
@@ -26,7 +26,7 @@ import util
 if __name__ == '__main__':
     util.setup_conf()
 
-dbversion = 5
+dbversion = 8
 dbversion_reset = dbversion
 
 
@@ -78,6 +78,45 @@ def dbclose(restart=False):
     if restart:
         dbversion = dbversion_reset
 
+_batch = False # after begin(), writes wait for commit()
+
+def begin():
+    '''Start a batch of writes which are saved together by commit(),
+        or not at all if rollback() is called instead.
+    '''
+
+    global _batch
+    _batch = True
+
+def commit():
+    'Save all of the writes since begin().'
+
+    global _batch
+    _batch = False
+    conn.commit()
+
+def rollback():
+    'Undo all of the writes since begin().'
+
+    global _batch
+    _batch = False
+    conn.rollback()
+
+def written():
+    'Save the write just made, unless it is part of a batch.'
+
+    if not _batch:
+        conn.commit()
+
+def write_failed():
+    '''Undo the write that just failed. In a batch, the error is
+        raised again so that the caller can rollback() the batch.
+    '''
+
+    if _batch:
+        raise
+    conn.rollback()
+
 def trywrite():
     dbopen()
     q = '''
@@ -174,6 +213,30 @@ CREATE TABLE tournament_stats (
     kills integer
 );
 
+CREATE TABLE tournament_jobs (
+    tournament datetime,
+    job integer,
+    robots text,
+    seed integer,
+    done integer
+);
+
+CREATE TABLE battle_seeds (
+    tournament datetime,
+    robots text,
+    seed integer
+);
+
+CREATE TABLE think_times (
+    tournament datetime,
+    program_name text,
+    ticks integer,
+    wall real,
+    cpu real,
+    maxwall real,
+    histogram text
+);
+
 CREATE TABLE trywrite (
     tw integer
 );
@@ -246,9 +309,9 @@ def add_robot(name, fp):
     '''
     try:
         c.execute(q, locals())
-        conn.commit()
+        written()
     except sqlite3.OperationalError:
-        conn.rollback()
+        write_failed()
 
 def update(name, win, opponents, outlasted, damage_caused, kills):
     fp = fingerprint(name)
@@ -268,9 +331,9 @@ def update(name, win, opponents, outlasted, damage_caused, kills):
         win = int(win) # turn True/False in to 1/0
         try:
             c.execute(q, locals())
-            conn.commit()
+            written()
         except sqlite3.OperationalError:
-            conn.rollback()
+            write_failed()
 
     else:
         add_robot(name, fp)
@@ -314,9 +377,9 @@ def add_tournament_robot(tournament, name, fp):
     '''
     try:
         c.execute(q, locals())
-        conn.commit()
+        written()
     except sqlite3.OperationalError:
-        conn.rollback()
+        write_failed()
 
 def tournament_update(tournament, kind, name, win, opponents, outlasted,
                                                     damage_caused, kills):
@@ -338,14 +401,187 @@ def tournament_update(tournament, kind, name, win, opponents, outlasted,
         '''
         try:
             c.execute(q, locals())
-            conn.commit()
+            written()
         except sqlite3.OperationalError:
-            conn.rollback()
+            write_failed()
 
     else:
         add_tournament_robot(tournament, name, fp)
         tournament_update(tournament, kind, name, win, opponents, outlasted, damage_caused, kills)
 
+def add_jobs(tournament, lineups, seed=None):
+    '''Queue up one battle for each lineup (a list of robot names)
+        in the tournament.
+
+    If seed is given, each battle gets its own seed counting up
+        from there.
+    '''
+
+    q = '''\
+    INSERT INTO tournament_jobs
+        (tournament,
+            job,
+            robots,
+            seed,
+            done)
+        VALUES
+            (?, ?, ?, ?, 0)
+    '''
+    rows = []
+    for job, lineup in enumerate(lineups):
+        if seed is None:
+            jobseed = None
+        else:
+            jobseed = seed + job
+        rows.append((tournament, job, ' '.join(lineup), jobseed))
+    try:
+        c.executemany(q, rows)
+        written()
+    except sqlite3.OperationalError:
+        write_failed()
+
+def pending_jobs(tournament):
+    '''Return a list of (job, lineup, seed) for the battles in the
+        tournament that have not been run yet.
+    '''
+
+    q = '''
+    SELECT job, robots, seed
+    FROM tournament_jobs
+    WHERE tournament = :tournament AND
+            done = 0
+    ORDER BY
+        job
+    '''
+    c.execute(q, locals())
+    r = c.fetchall()
+    return [(job, tuple(robots.split()), seed) for job, robots, seed in r]
+
+def count_jobs(tournament):
+    'Return the total number of battles queued for the tournament.'
+
+    q = '''
+    SELECT count(*)
+    FROM tournament_jobs
+    WHERE tournament = :tournament
+    '''
+    c.execute(q, locals())
+    r = c.fetchone()
+    return r[0]
+
+def job_done(tournament, job):
+    q = '''\
+    UPDATE tournament_jobs
+    SET done = 1
+    WHERE
+        tournament = :tournament AND
+        job = :job
+    '''
+    try:
+        c.execute(q, locals())
+        written()
+    except sqlite3.OperationalError:
+        write_failed()
+
+def add_battle_seed(tournament, robots, seed):
+    q = '''\
+    INSERT INTO battle_seeds
+        (tournament,
+            robots,
+            seed)
+        VALUES
+            (:tournament,
+                :robots,
+                :seed)
+    '''
+    try:
+        c.execute(q, locals())
+        written()
+    except sqlite3.OperationalError:
+        write_failed()
+
+def battle_seeds(tournament):
+    '''Return a list of (robots, seed) for the battles of the
+        tournament, where robots is the lineup as a string.
+    '''
+
+    q = '''
+    SELECT robots, seed
+    FROM battle_seeds
+    WHERE tournament = :tournament
+    '''
+    c.execute(q, locals())
+    return c.fetchall()
+
+def add_think_time(tournament, name, ticks, wall, cpu, maxwall, histogram):
+    '''Save the time the robot spent in respond() in one battle.
+
+    tournament may be None for battles outside of a tournament.
+        histogram is the list of tick counts in each bucket (see
+        profiler.think_buckets).
+
+    '''
+
+    histogram = ' '.join(str(n) for n in histogram)
+    q = '''\
+    INSERT INTO think_times
+        (tournament,
+            program_name,
+            ticks,
+            wall,
+            cpu,
+            maxwall,
+            histogram)
+        VALUES
+            (:tournament,
+                :name,
+                :ticks,
+                :wall,
+                :cpu,
+                :maxwall,
+                :histogram)
+    '''
+    try:
+        c.execute(q, locals())
+        written()
+    except sqlite3.OperationalError:
+        write_failed()
+
+def think_times(tournament=None):
+    '''Return a list of (name, ticks, wall, cpu, maxwall, histogram)
+        for each robot, over all battles in the tournament, or over
+        all battles if tournament is None.
+
+    wall and cpu are the total seconds, maxwall is the longest
+        time for a single tick and histogram is the list of tick
+        counts in each bucket.
+
+    '''
+
+    q = '''
+    SELECT program_name, ticks, wall, cpu, maxwall, histogram
+    FROM think_times
+    '''
+    if tournament is not None:
+        q += '''
+    WHERE tournament = :tournament
+    '''
+    c.execute(q, locals())
+
+    totals = {}
+    for name, ticks, wall, cpu, maxwall, histogram in c.fetchall():
+        histogram = [int(n) for n in histogram.split()]
+        if name not in totals:
+            totals[name] = [name, 0, 0.0, 0.0, 0.0, [0] * len(histogram)]
+        t = totals[name]
+        t[1] += ticks
+        t[2] += wall
+        t[3] += cpu
+        t[4] = max(t[4], maxwall)
+        t[5] = [a + b for a, b in zip(t[5], histogram)]
+
+    return [tuple(totals[name]) for name in sorted(totals)]
+
 def tournament_results(tournament):
     q = '''
     SELECT *
@@ -0,0 +1,279 @@
+# Copyright 2009-2014 Lee Harr
+#
+# This file is part of pybotwar.
+#     http://pybotwar.googlecode.com/
+#
+# Pybotwar is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pybotwar is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Pybotwar.  If not, see <http://www.gnu.org/licenses/>.
+
+
+'''Run the battles of a tournament in several processes at once.
+
+Battles are run without graphics (the noview view must already be
+    selected) by a multiprocessing pool. Each battle sends its
+    results back to the main process, which is the only process
+    that writes to the stats database.
+
+'''
+
+
+import os
+import sys
+import signal
+import random
+import itertools
+import logging
+import multiprocessing
+
+import viewselect
+import world
+import stats
+import conf
+
+
+_pool = None # warm robot processes for the battles run in this process
+
+
+def init_worker(quiet):
+    'Set up a process of the pool before it runs any battles.'
+
+    if quiet:
+        # Battles print a lot. Only the progress is shown.
+        sys.stdout = open(os.devnull, 'w')
+
+        # Leave Ctrl-C to the main process, which stops the pool
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+        # Skip formatting battle events that would not be shown anyway
+        logger = logging.getLogger('PybotwarLogger')
+        if logger.level < logging.WARNING:
+            logger.setLevel(logging.WARNING)
+
+    global _pool
+    if conf.worker_pool:
+        from pool import WorkerPool
+        _pool = WorkerPool(conf.worker_pool)
+
+def run_battle(battle):
+    '''Run one battle. battle is the tuple
+        (robots, tournament, testmode, job, seed)
+
+    Returns the tuple (battle, results, seed, thinktimes) where
+        results is the Game.results dictionary, seed is the seed the
+        battle used and thinktimes is the Game.think_results.
+
+    '''
+
+    robots, tournament, testmode, job, seed = battle
+
+    from game import Game
+
+    game = Game(testmode, tournament, _pool, seed=seed, robots=robots)
+    game.run(update_stats=False)
+
+    view = viewselect.get_view_module()
+    world.Robot.nrobots = 0
+    view.Robot.nrobots = 0
+
+    return battle, game.results, game.seed, game.think_results
+
+def run_serial(battles):
+    'Run the battles one after another in this process.'
+
+    for n, battle in enumerate(battles):
+        print 'Battle', n+1
+        yield run_battle(battle)
+
+def run_battles(battles, jobs=1):
+    '''Run the list of battles, jobs of them at a time.
+
+    Each battle is a tuple (robots, tournament, testmode, job, seed),
+        with the list of robots to load. Results are saved in the
+        stats database as each battle finishes. If job is not None,
+        that job is marked done in the tournament's job queue, in the
+        same transaction. If seed is None, the battle picks its own.
+
+    '''
+
+    from game import save_results
+
+    nbattles = len(battles)
+    if jobs > 1:
+        mpool = multiprocessing.Pool(jobs, init_worker, (True,))
+        finished = wait_all(mpool.imap_unordered(run_battle, battles))
+    else:
+        init_worker(False)
+        mpool = None
+        finished = run_serial(battles)
+
+    try:
+        for n, (battle, results, seed, thinktimes) in enumerate(finished):
+            robots, tournament, testmode, job, _ = battle
+            # Save the results and mark the job done together, so that
+            #   a resumed tournament never counts the battle twice
+            stats.begin()
+            try:
+                save_results(results, tournament, testmode, seed, robots,
+                                thinktimes)
+                if job is not None:
+                    stats.job_done(tournament, job)
+            except:
+                stats.rollback()
+                raise
+            stats.commit()
+
+            winners = [r[1] for r in results.values() if r[2]]
+            if winners:
+                outcome = 'WINNER: %s' % winners[0]
+            else:
+                outcome = 'no winner'
+            print 'Battle %s of %s finished (%s) %s' % (n+1, nbattles,
+                                                ' '.join(robots), outcome)
+            sys.stdout.flush()
+
+    except KeyboardInterrupt:
+        if mpool is not None:
+            mpool.terminate()
+            mpool.join()
+        raise
+
+    finally:
+        if mpool is not None:
+            mpool.close()
+            mpool.join()
+        elif _pool is not None:
+            _pool.close()
+
+def wait_all(finished):
+    '''Yield the results from the pool as they come in.
+
+    Waiting with a timeout lets Ctrl-C through to the main process.
+
+    '''
+
+    while True:
+        try:
+            yield finished.next(60)
+        except multiprocessing.TimeoutError:
+            continue
+        except StopIteration:
+            return
+
+def run_tournament(tournament, nbattles, jobs=1, testmode=False, seed=None):
+    '''Run nbattles battles between conf.robots and print the results.
+
+    If seed is given, the battles use seeds counting up from there.
+
+    '''
+
+    robots = tuple(conf.robots)
+    battles = []
+    for n in range(nbattles):
+        if seed is None:
+            battleseed = None
+        else:
+            battleseed = seed + n
+        battles.append((robots, tournament, testmode, None, battleseed))
+    run_battles(battles, jobs)
+
+    print_results(tournament, nbattles)
+
+def ncombinations(n, k):
+    'Return the number of ways to choose k of n things.'
+
+    total = 1
+    for i in range(k):
+        total = total * (n - i) / (i + 1)
+    return total
+
+def sample_lineups(robots, nlineups, seed):
+    '''Choose nlineups different lineups from the list of robots,
+        instead of running every possible combination.
+
+    The lineups are spread evenly over the lineup sizes (2 robots,
+        3 robots, ... all robots), as far as each size has enough
+        different lineups. Each lineup is filled with the robots that
+        have been chosen the fewest times so far, so every robot
+        appears about equally often.
+
+    The same robots, nlineups and seed always give the same lineups.
+
+    '''
+
+    rng = random.Random(seed)
+    robots = list(robots)
+    nrobots = len(robots)
+    sizes = range(2, nrobots+1)
+
+    # Smallest strata first, so what they cannot use goes to the others
+    quotas = {}
+    left = nlineups
+    bysize = sorted(sizes, key=lambda k: ncombinations(nrobots, k))
+    for i, k in enumerate(bysize):
+        share = left / (len(bysize) - i)
+        quotas[k] = min(share, ncombinations(nrobots, k))
+        left -= quotas[k]
+
+    counts = dict.fromkeys(robots, 0)
+    chosen = set()
+    lineups = []
+    for k in sizes:
+        for n in range(quotas[k]):
+            lineup = pick_lineup(robots, k, counts, chosen, rng)
+            chosen.add(lineup)
+            lineups.append(lineup)
+            for robot in lineup:
+                counts[robot] += 1
+
+    return lineups
+
+def pick_lineup(robots, k, counts, chosen, rng):
+    '''Return a lineup of k of the robots, not already in chosen,
+        favoring the robots with the lowest counts.
+    '''
+
+    order = dict((robot, i) for i, robot in enumerate(robots))
+
+    for attempt in range(100):
+        # Break ties at random, and loosen the preference for the
+        #   least used robots if the lineup was already chosen.
+        key = lambda robot: counts[robot] + rng.uniform(0, attempt + 1)
+        lineup = sorted(robots, key=key)[:k]
+        lineup = tuple(sorted(lineup, key=order.get))
+        if lineup not in chosen:
+            return lineup
+
+    unused = [lineup for lineup in itertools.combinations(robots, k)
+                if lineup not in chosen]
+    return rng.choice(unused)
+
+def print_results(tournament, nbattles):
+    results = stats.tournament_results(tournament)
+    print;print;print;
+    print 'Tournament Results'
+    print nbattles, 'battles between', len(results), 'robots'
+    print
+    for line in results:
+        print line[1], ':', line[4], 'wins', ':', line[6], 'outlasted', ':', line[7], 'dmg caused', ':', line[8], 'kills'
+
+    thinktimes = stats.think_times(tournament)
+    if thinktimes:
+        print
+        print 'Think time per tick (ms) and share of ticks near the timeout'
+        for name, ticks, wall, cpu, maxwall, histogram in thinktimes:
+            # The last two buckets are 90% of the tick_timeout and over
+            near = sum(histogram[-2:])
+            print name, ':', '%.2f' % (1000 * wall / ticks), 'wall', ':',
+            print '%.2f' % (1000 * cpu / ticks), 'cpu', ':',
+            print '%.2f' % (1000 * maxwall), 'max', ':',
+            print '%.1f%%' % (100.0 * near / ticks), 'over 90%'
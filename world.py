@@ -18,16 +18,81 @@
 
 
 import random
+from collections import OrderedDict
+
+import logging
+logger = logging.getLogger('PybotwarLogger')
 
 import Box2D as box2d
 pi = 3.1415927410125732
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# With fewer robots than this, plain Python is faster than numpy
+NUMPY_MIN_ROBOTS = 16
+
 import conf
+from profiler import clock
 
 import viewselect
 view = viewselect.get_view_module()
 
 
+# Radar beam, in turret coordinates
+PING_START = (1.12, 0)
+PING_LENGTH = 65.0
+PING_DIR = (PING_LENGTH, 0.0)
+
+class PingCallback(box2d.b2RayCastCallback):
+    '''Find the closest fixture along a radar beam.
+
+    One callback is made and used again for every ping. Call reset()
+        before each ray cast.
+
+    '''
+
+    def __init__(self):
+        box2d.b2RayCastCallback.__init__(self)
+        self.reset()
+
+    def reset(self):
+        self.fixture = None
+        self.fraction = 1.0
+
+    def ReportFixture(self, fixture, point, normal, fraction):
+        self.fixture = fixture
+        self.fraction = fraction
+        # Clip the beam here, so only closer fixtures are reported
+        return fraction
+
+pingcallback = PingCallback()
+
+
+class BlastCallback(box2d.b2QueryCallback):
+    '''Collect the fixtures near an explosion.
+
+    One callback is made and used again for every explosion. Call
+        reset() before each query.
+
+    '''
+
+    def __init__(self):
+        box2d.b2QueryCallback.__init__(self)
+        self.reset()
+
+    def reset(self):
+        self.fixtures = []
+
+    def ReportFixture(self, fixture):
+        self.fixtures.append(fixture)
+        return True
+
+blastcallback = BlastCallback()
+
+
 class Robot(object):
     nrobots = 0
     def __init__(self, wld, kind, name, pos, ang):
@@ -144,29 +209,67 @@ class Robot(object):
 
 
 
+def degrees_normalized(radians):
+    '''Given a list of angles in radians, return the list of the
+        same angles in whole degrees, normalized the same as
+        Robot._to_degrees_normalized()
+    '''
+
+    degrees = (180 / pi) * numpy.array(radians)
+    # Round half away from zero, like the builtin round()
+    degrees = numpy.sign(degrees) * numpy.floor(numpy.abs(degrees) + 0.5)
+    degrees = degrees.astype(int) % 360
+    degrees[degrees > 180] -= 360
+    return degrees.tolist()
+
+
+def body_state(body):
+    'Return the position, angle and velocities of body as plain values.'
+
+    pos = body.position
+    vel = body.linearVelocity
+    return (pos.x, pos.y), body.angle, (vel.x, vel.y), body.angularVelocity
+
+def set_body_state(body, state):
+    'Put body back in to a state returned by body_state()'
+
+    pos, angle, vel, angvel = state
+    body.position = pos
+    body.angle = angle
+    body.linearVelocity = vel
+    body.angularVelocity = angvel
+
+
+def muzzle(robot):
+    '''Return the position, angle and velocity of a bullet just
+        fired from the robot's turret.
+    '''
+
+    r = robot.turret
+    pos = r.position
+    vel = r.linearVelocity
+    ang = r.angle
+
+    blocalvel = box2d.b2Vec2(conf.bulletspeed, 0)
+    bwvel = r.GetWorldVector(blocalvel)
+    bvel = bwvel + vel
+    #print bvel, bvel.length
+
+    blocalpos = box2d.b2Vec2(.1, 0)
+    bwpos = r.GetWorldVector(blocalpos)
+    bpos = bwpos + pos
+
+    return bpos, ang, bvel
+
+
 class Bullet(object):
     def __init__(self, wld, robot):
         self.wld = wld
         w = wld.w
-        self.robot = robot # Fired by this robot
 
-        self._fuse = None
-        self._exploding = False
-
-        r = robot.turret
-        pos = r.position
-        vel = r.linearVelocity
-        ang = r.angle
-
-        blocalvel = box2d.b2Vec2(conf.bulletspeed, 0)
-        bwvel = r.GetWorldVector(blocalvel)
-        bvel = bwvel + vel
-        #print bvel, bvel.length
+        bpos, ang, bvel = muzzle(robot)
 
         bodyDef = box2d.b2BodyDef(type=box2d.b2_dynamicBody,)
-        blocalpos = box2d.b2Vec2(.1, 0)
-        bwpos = r.GetWorldVector(blocalpos)
-        bpos = bwpos + pos
         bodyDef.position = bpos
         bodyDef.angle = ang
         bodyDef.isBullet = True
@@ -176,7 +279,6 @@ class Bullet(object):
         body = w.CreateBody(bodyDef)
         #print body
         #print 'IB', body.isBullet
-        body.linearVelocity = bvel
         body.CreatePolygonFixture(
                     box=(0.1,0.1),
                     friction=0,
@@ -187,26 +289,68 @@ class Bullet(object):
 
         body.userData['actor'] = self
         body.userData['kind'] = 'bullet'
-        body.userData['shooter'] = robot
 
         self.body = body
 
-        v = wld.v.addbullet(pos)
+        v = wld.v.addbullet(robot.turret.position)
         self.v = v
 
+        self.load(robot)
+
+    def load(self, robot):
+        '''Get the bullet ready to be fired by the robot.
+
+        Used for new bullets, and for spent bullets taken back out
+            of the World.bullet_pool.
+
+        '''
+
+        wld = self.wld
+        wld.nbullets += 1
+        self.id = wld.nbullets # key in World.bullets
+        self.robot = robot # Fired by this robot
+
+        self._fuse = None
+        self._exploding = False
+        self.e = None
+
+        body = self.body
+        bpos, ang, bvel = muzzle(robot)
+        if not body.active:
+            # Coming back from the pool
+            body.transform = (bpos, ang)
+            body.angularVelocity = 0
+            fixture = body.fixtures[0]
+            filterdata = fixture.filterData
+            filterdata.groupIndex = -robot.n
+            fixture.filterData = filterdata
+            body.active = True
+            body.awake = True
+            self.v.setpos(robot.turret.position)
+            self.v.show()
+        body.linearVelocity = bvel
+
+        body.userData['shooter'] = robot
+
+    def unload(self):
+        '''Take the spent bullet out of the world, so that it can be
+            put in the World.bullet_pool and used again.
+        '''
+
+        body = self.body
+        body.active = False
+        body.userData['shooter'] = None
+        self.robot = None
+        self.v.hide()
+
     def explode(self):
+        'Show the explosion. The damage is done by World.blast().'
+
         self._exploding = 1
 
         robot = self.body.userData['shooter'].name
         #print robot,'bullet explode at', self.body.position
 
-        for ring, radius in enumerate(conf.explosion_radii):
-            s = self.body.CreateCircleFixture(radius=radius)
-            s.userData = {}
-            s.userData['ring'] = ring
-            s.userData['bullet'] = self
-            s.userData['hits'] = {0:[], 1:[], 2:[]}
-
         e = self.wld.v.addexplosion(self.body.position)
         self.e = e
 
@@ -229,14 +373,26 @@ class Wall(object):
 
 
 class World(object):
-    def __init__(self):
+    def __init__(self, rng=None):
+        if rng is None:
+            rng = random.Random()
+        self.rng = rng # all randomness in the world comes from here
+        self.profiler = None # profiler.Profiler if profiling the battle
+
         self.count = 1000
         self.force = 10
 
         self.robots = {}
-        self.bullets = []
+        self.bullets = OrderedDict() # bullet id -> Bullet, oldest first
+        self.nbullets = 0 # bullets made so far, for the bullet ids
+        self.bullet_pool = [] # spent bullets, to be used again
+        # The explosion rings, innermost first
+        self.blastrings = [box2d.b2CircleShape(radius=radius)
+                                for radius in conf.explosion_radii]
         self.sprites = {}
-        self.to_destroy = []
+        self.to_destroy = [] # robots and bullets to destroy after the step
+        self.destroying = set() # the same, for quick lookups
+        self.pings = [] # names of robots pinging this tick
 
         halfx = 30
         self.ahalfx = 20
@@ -276,10 +432,10 @@ class World(object):
             pass
 
     def makeblock(self):
-        x = random.randrange(-self.ahalfx, self.ahalfx+1)
-        y = random.randrange(-self.ahalfy, self.ahalfy+1)
-        w = random.randrange(1, 20)/10.0
-        h = random.randrange(1, 20)/10.0
+        x = self.rng.randrange(-self.ahalfx, self.ahalfx+1)
+        y = self.rng.randrange(-self.ahalfy, self.ahalfy+1)
+        w = self.rng.randrange(1, 20)/10.0
+        h = self.rng.randrange(1, 20)/10.0
         wl = Wall(self.w, (x, y), (w, h))
 
     def posoccupied(self, pos):
@@ -297,12 +453,12 @@ class World(object):
         rhy = self.ahalfy-2
 
         while pos is None or self.posoccupied(pos):
-            rx = random.randrange(-rhx, rhx)
-            ry = random.randrange(-rhy, rhy)
+            rx = self.rng.randrange(-rhx, rhx)
+            ry = self.rng.randrange(-rhy, rhy)
             pos = box2d.b2Vec2(rx, ry)
 
         if ang is None:
-            ang = random.randrange(628) / float(100)
+            ang = self.rng.randrange(628) / float(100)
 
         robot = Robot(self, kind, name, pos, ang)
         self.robots[name] = robot
@@ -320,47 +476,116 @@ class World(object):
             robot._cannonreload += conf.unloaded_fire_reload_penalty
             return None
 
-        bullet = Bullet(self, robot)
+        if self.bullet_pool:
+            bullet = self.bullet_pool.pop()
+            bullet.load(robot)
+        else:
+            bullet = Bullet(self, robot)
         bullet._fuse = fuse
-        self.bullets.append(bullet)
+        self.bullets[bullet.id] = bullet
 
         robot._cannonheat += conf.cannon_heating_per_shot
         robot._cannonreload = conf.cannon_reload_ticks
 
         return bullet
 
-    def makeping(self, rname, rnd):
-        robot = self.robots[rname]
-        body = robot.turret
+    def sensor_snapshot(self, rnd):
+        '''Read the sensors of every robot in one pass.
 
-        segmentLength = 65.0
+        Returns a dictionary of
+            robotname -> (tick, health, x, y, turret, pingtype,
+                            pingangle, pingdist, gyro, heat, loading,
+                            pinged)
+            the tuple the protocol functions take.
 
-        blocalpos = box2d.b2Vec2(1.12, 0)
+        Robots do not change each other's sensors while their commands
+            are carried out (pings wait for makepings), so the values
+            read at the start of a tick hold for the whole tick.
 
-        laserStart = (1.12, 0)
-        laserDir = (segmentLength, 0.0)
-        p1 = body.GetWorldPoint(laserStart)
-        p2 = body.GetWorldVector(laserDir)
-        p2+=p1
+        The angle and int conversions are done for all robots at once,
+            with numpy if it is available and conf.use_numpy is set,
+            and there are enough robots for it to be faster.
 
-        class CB(box2d.b2RayCastCallback):
-            shapehit = None
-            distance = None
-            def ReportFixture(self, fixture, point, normal, fraction):
-                pt = box2d.b2Vec2(*point)
-                self.distance = (pt-p1).length
-                CB.shapehit = fixture
-                #print 'CB', fixture.body.userData, (pt-p1).length
-                return fraction
+        '''
 
-        cb = CB()
+        rows = []
+        for name, robot in self.robots.items():
+            body = robot.body
+            pos = body.position
+            rows.append((name, pos.x, pos.y, body.angle,
+                            robot.turretjoint.angle, robot._cannonheat,
+                            robot._cannonreload, robot))
+
+        if not rows:
+            return {}
+
+        names, xs, ys, angles, turrets, heats, loadings, robots = zip(*rows)
+
+        if (numpy is not None and conf.use_numpy and
+                len(rows) >= NUMPY_MIN_ROBOTS):
+            xs = numpy.array(xs).astype(int).tolist()
+            ys = numpy.array(ys).astype(int).tolist()
+            heats = numpy.array(heats).astype(int).tolist()
+            loadings = numpy.array(loadings).astype(int).tolist()
+            gyros = degrees_normalized(angles)
+            turrets = degrees_normalized(turrets)
+        else:
+            xs = map(int, xs)
+            ys = map(int, ys)
+            heats = map(int, heats)
+            loadings = map(int, loadings)
+            # Any robot will do. The conversion is the same for all.
+            normalize = robots[0]._to_degrees_normalized
+            gyros = map(normalize, angles)
+            turrets = map(normalize, turrets)
+
+        snapshot = {}
+        for name, robot, x, y, tur, gyro, heat, loading in zip(names,
+                        robots, xs, ys, turrets, gyros, heats, loadings):
+            # Health is sent as an int, as the binary protocol packs it
+            snapshot[name] = (rnd, int(robot.health), x, y, tur,
+                                robot._pingtype, robot._pingangle,
+                                robot._pingdist, gyro, heat, loading,
+                                int(robot._pinged == rnd - 1))
+        return snapshot
+
+    def makepings(self, rnd):
+        '''Carry out the pings of all the robots that asked for one
+            this tick, and set their ping sensors.
+        '''
+
+        pings = self.pings
+        if not pings:
+            return
+        self.pings = []
+
+        robots = self.robots
+        for rname in pings:
+            robot = robots.get(rname)
+            if robot is None:
+                continue
+            kind, angle, dist = self.makeping(rname, rnd)
+            robot._pingtype = kind[0]
+            robot._pingangle = angle
+            robot._pingdist = int(dist)
+
+    def makeping(self, rname, rnd):
+        robot = self.robots[rname]
+        body = robot.turret
+
+        p1 = body.GetWorldPoint(PING_START)
+        p2 = body.GetWorldVector(PING_DIR)
+        p2 += p1
+
+        cb = pingcallback
+        cb.reset()
         self.w.RayCast(cb, p1, p2)
         angle = robot.get_turretangle()
-        dist = cb.distance
 
-        if cb.shapehit:
-            shape = cb.shapehit
-            hitbody = shape.body
+        if cb.fixture is not None:
+            dist = cb.fraction * PING_LENGTH
+            hitbody = cb.fixture.body
+            cb.fixture = None
             kind = hitbody.userData['kind']
             if kind == 'robot':
                 actor = hitbody.userData['actor']
@@ -372,15 +597,132 @@ class World(object):
             #   robot is pressed right up against a wall, though.
             return 'w', angle, 0
 
-    def step(self):
+    def step(self, render=True):
+        '''Advance the world by one tick.
+
+        If render is False, the view is not updated. Use this to run
+            several ticks for each frame that is drawn.
+
+        '''
+
+        prof = self.profiler
+        if prof is not None:
+            t = clock()
+
         #self.moveit()
         #print 'STEP', self.w.Step
         self.w.Step(self.timeStep, self.velIterations, self.posIterations)
+        if prof is not None:
+            t = prof.lap('physics', t)
+
         self.do_destroy()
-        self.showit()
+        if prof is not None:
+            t = prof.lap('destroy', t)
+
+        self.update()
+        if prof is not None:
+            t = prof.lap('update', t)
+
+        if render:
+            self.showit()
+
+
+    def update(self):
+        'Cool the cannons, run the fuses of the bullets and set them off.'
+
+        for name, robot in self.robots.items():
+            if robot._cannonheat > 0:
+                robot._cannonheat -= conf.cannon_cooling_per_tick
+            if robot._cannonreload > 0:
+                robot._cannonreload -= 1
 
+        for bullet in self.bullets.itervalues():
+            if bullet._fuse is not None:
+                bullet._fuse -= 1
+                if bullet._fuse == 0:
+                    logger.info('shell explodes')
+                    bullet.explode()
+                    self.blast(bullet)
+
+            if bullet._exploding:
+                if bullet._exploding > 2:
+                    self.destroy_later(bullet)
+                else:
+                    bullet._exploding += 1
+
+    def blast(self, bullet):
+        '''Damage the robots caught in the explosion of the bullet,
+            and destroy any other bullets in the blast area.
+
+        A robot is hit by each ring that its shape overlaps. The rings
+            are cumulative (see conf.explosion_damage), so a robot
+            close enough to be hit by ring 0 is also hit by the others.
+
+        '''
+
+        body = bullet.body
+        pos = body.position
+        rings = self.blastrings
+        r = conf.explosion_radii[-1]
+        aabb = box2d.b2AABB(lowerBound=(pos.x-r, pos.y-r),
+                            upperBound=(pos.x+r, pos.y+r))
+        blastcallback.reset()
+        self.w.QueryAABB(blastcallback, aabb)
+
+        xf = body.transform
+        outer = len(rings) - 1
+        hit = {} # robot -> innermost ring that hit it
+        for fixture in blastcallback.fixtures:
+            other = fixture.body
+            if other == body:
+                continue
+            kind = other.userData['kind']
+            actor = other.userData['actor']
+            if kind == 'robot':
+                # The robot and its turret both land here
+                for ring in range(hit.get(actor, len(rings))):
+                    if box2d.b2TestOverlap(rings[ring], 0, fixture.shape, 0,
+                                            xf, other.transform):
+                        hit[actor] = ring
+                        break
+            elif kind == 'bullet' and not actor._exploding:
+                if box2d.b2TestOverlap(rings[outer], 0, fixture.shape, 0,
+                                            xf, other.transform):
+                    self.destroy_later(actor)
+
+        shooter = body.userData['shooter']
+        for robot in sorted(hit, key=lambda robot: robot.n):
+            dmg = sum(conf.explosion_damage[hit[robot]:])
+            logger.info('    Robot %s in blast area for %s', robot.name, dmg)
+            self.damage(robot, dmg, shooter)
+
+    def damage(self, robot, dmg, shooter=None):
+        '''Take dmg off the robot's health. If the damage came from a
+            bullet, shooter is the robot that fired it.
+        '''
+
+        before = robot.health
+        robot.health -= dmg
+        if shooter is not None and before > 0:
+            shooter._damage_caused += dmg
+        robot.i.health.step(dmg)
+        if robot.health <= 0:
+            robot.alive = False
+            if shooter is not None and before > 0:
+                shooter._kills += 1
+                logger.info('    ! %s', shooter.name)
+            if conf.remove_dead_robots:
+                self.destroy_later(robot)
+        else:
+            logger.info('    down to %s', robot.health)
 
     def showit(self):
+        'Move the view items to where the bodies are now.'
+
+        prof = self.profiler
+        if prof is not None:
+            t = clock()
+
         for name, robot in self.robots.items():
             r = robot.body
             #robot.turretcontrol()
@@ -401,44 +743,43 @@ class World(object):
             #robot.t.setpos(pos2)
             robot.v.set_turr_rot(-tang)
 
-            if robot._cannonheat > 0:
-                robot._cannonheat -= conf.cannon_cooling_per_tick
-            if robot._cannonreload > 0:
-                robot._cannonreload -= 1
-
-        for bullet in self.bullets:
+        for bullet in self.bullets.itervalues():
             b = bullet.body
             pos2 = b.position
             bullet.v.setpos(pos2)
             #print bullet.linearVelocity
 
-            if bullet._fuse is not None:
-                bullet._fuse -= 1
-                if bullet._fuse == 0:
-                    print 'shell explodes'
-                    bullet.explode()
-
-            if bullet._exploding:
-                if bullet._exploding > 2:
-                    if bullet not in self.to_destroy:
-                        self.to_destroy.append(bullet)
-                else:
-                    bullet._exploding += 1
-
         #print
+        if prof is not None:
+            t = prof.lap('showit', t)
+
         self.v.step()
+        if prof is not None:
+            prof.lap('view', t)
+
+    def destroy_later(self, model):
+        'Destroy the robot or bullet after the physics step.'
+
+        if model not in self.destroying:
+            self.destroying.add(model)
+            self.to_destroy.append(model)
 
     def do_destroy(self):
         while self.to_destroy:
             model = self.to_destroy.pop()
+            self.destroying.discard(model)
             body = model.body
             if hasattr(body, 'iswall') and body.iswall:
                 continue
             #print 'destroy', id(body)
-            if model in self.bullets:
-                self.bullets.remove(model)
+            if body.userData['kind'] == 'bullet':
+                del self.bullets[model.id]
                 if model._exploding:
                     model.e.kill()
+                if len(self.bullet_pool) < conf.bullet_pool:
+                    model.unload()
+                    self.bullet_pool.append(model)
+                    continue
             #print 's0', self.v.sprites
             model.v.kill()
 
@@ -450,7 +791,91 @@ class World(object):
             self.w.DestroyBody(body)
             #print 'destroyed', id(body)
 
+    robot_counters = ['health', 'alive',
+                        '_cannonheat', '_cannonreload',
+                        '_pingtype', '_pingangle', '_pingdist', '_pinged',
+                        '_outlasted', '_damage_caused', '_kills',
+                        '_turret_torque']
+
+    def snapshot(self):
+        '''Return the state of the world between two ticks, as plain
+            values (lists, dictionaries, numbers and strings) which can
+            be pickled or copied.
+
+        Use restore() to load the snapshot in to a new World.
+
+        '''
+
+        robots = []
+        for robot in sorted(self.robots.values(), key=lambda r: r.n):
+            d = {}
+            d['kind'] = robot.kind
+            d['name'] = robot.name
+            d['n'] = robot.n
+            d['body'] = body_state(robot.body)
+            d['turret'] = body_state(robot.turret)
+            d['motorSpeed'] = robot.turretjoint.motorSpeed
+            for attr in self.robot_counters:
+                d[attr] = getattr(robot, attr)
+            robots.append(d)
+
+        bullets = []
+        for bullet in self.bullets.itervalues():
+            d = {}
+            d['id'] = bullet.id
+            d['shooter'] = bullet.body.userData['shooter'].name
+            d['body'] = body_state(bullet.body)
+            d['fuse'] = bullet._fuse
+            d['exploding'] = bullet._exploding
+            d['destroy'] = bullet in self.destroying
+            bullets.append(d)
+
+        return dict(robots=robots, bullets=bullets)
+
+    def restore(self, snapshot):
+        '''Load a snapshot from snapshot() in to this World, which
+            should not have any robots yet.
+
+        The restored world is very close to the original, but Box2D
+            does not expose everything it keeps between steps (like
+            contact points) so the battles may drift apart over time.
 
+        '''
+
+        for d in snapshot['robots']:
+            # Keep the robot number, used to keep robots from hitting
+            #   their own bullets.
+            Robot.nrobots = d['n'] - 1
+            pos, ang = d['body'][0], d['body'][1]
+            robot = self.makerobot(d['kind'], d['name'],
+                                    box2d.b2Vec2(pos), ang)
+            set_body_state(robot.body, d['body'])
+            set_body_state(robot.turret, d['turret'])
+            robot.turretjoint.motorSpeed = d['motorSpeed']
+            for attr in self.robot_counters:
+                setattr(robot, attr, d[attr])
+            damage = conf.maxhealth - robot.health
+            if damage > 0:
+                robot.i.health.step(damage)
+
+        for d in snapshot['bullets']:
+            shooter = self.robots.get(d['shooter'])
+            if shooter is None:
+                # Shooter was destroyed. Shots already fired still count.
+                continue
+            bullet = Bullet(self, shooter)
+            # Keep the bullet id, and do not reuse it for new bullets
+            bullet.id = d['id']
+            self.nbullets = max(self.nbullets, bullet.id)
+            set_body_state(bullet.body, d['body'])
+            bullet._fuse = d['fuse']
+            if d['exploding']:
+                # The blast damage was already done
+                bullet.explode()
+                bullet._exploding = d['exploding']
+            self.bullets[bullet.id] = bullet
+            if d['destroy']:
+                self.destroy_later(bullet)
 
 
     def make_testrobots(self):
@@ -500,7 +925,7 @@ class World(object):
 
             r.ApplyTorque(4)
 
-            bullet = random.randrange(3)
+            bullet = self.rng.randrange(3)
             if bullet == 2:
                 #print name, 'shoots'
                 self.makebullet(name)
@@ -525,110 +950,49 @@ class CL(box2d.b2ContactListener):
 
         if kind2=='robot':
             if kind1=='bullet':
-                s1 = contact.fixtureA.shape
-                if hasattr(s1, 'userData'):
-                    ring = s1.userData.get('ring', None)
-                else:
-                    ring = None
-
                 shooter = b1.userData['shooter']
-                if ring is None and shooter == actor2:
+                if shooter == actor2:
                     #can't shoot yourself
                     pass
-                elif ring is None:
-                    dmg = hitdmg
-                    print 'Robot', actor2.name, 'shot for', dmg,
                 else:
-                    hits = s1.userData['hits']
-                    if actor2 not in hits[ring]:
-                        dmg = conf.explosion_damage[ring]
-                        print '    Robot', actor2.name, 'in blast area for', dmg,
-                        hits[ring].append(actor2)
-                    else:
-                        pass
-                        #print actor2.name, 'already hit by ring', ring
+                    dmg = hitdmg
+                    logger.info('Robot %s shot for %s', actor2.name, dmg)
             else:
                 shooter = None
                 if nimpulse > cds:
                     dmg = coldmg
-                    print 'Robot', actor2.name, 'collision with', kind1
-                    print '    IMP', nimpulse, 'for', dmg, 'damage',
+                    logger.info('Robot %s collision with %s',
+                                    actor2.name, kind1)
+                    logger.info('    IMP %s for %s damage', nimpulse, dmg)
 
             if dmg:
-                before = actor2.health
-                actor2.health -= dmg
-                if shooter is not None and before > 0:
-                    shooter._damage_caused += dmg
-                actor2.i.health.step(dmg)
-                if actor2.health <= 0:
-                    actor2.alive = False
-                    if shooter is not None and before > 0:
-                        shooter._kills += 1
-                        print '!', shooter.name,
-                    if conf.remove_dead_robots:
-                        if actor2 not in self.w.to_destroy:
-                            self.w.to_destroy.append(actor2)
-                    print
-                else:
-                    print 'down to', actor2.health
+                self.w.damage(actor2, dmg, shooter)
 
         if kind1=='robot':
             if kind2=='bullet':
-                fB = contact.fixtureB
-                s2 = contact.fixtureA.shape
-                if hasattr(fB, 'userData') and fB.userData is not None:
-                    ring = fB.userData.get('ring', None)
-                else:
-                    ring = None
                 shooter = b2.userData['shooter']
-                if ring is None and shooter == actor1:
+                if shooter == actor1:
                     #can't shoot yourself
                     pass
-                elif ring is None:
-                    dmg = hitdmg
-                    print 'Robot', actor1.name, 'shot for', dmg,
                 else:
-                    hits = fB.userData['hits']
-                    if actor1 not in hits[ring]:
-                        dmg = conf.explosion_damage[ring]
-                        print '    Robot', actor1.name, 'in blast area for', dmg,
-                        hits[ring].append(actor1)
-                    else:
-                        pass
-                        #print actor1.name, 'already hit by ring', ring
+                    dmg = hitdmg
+                    logger.info('Robot %s shot for %s', actor1.name, dmg)
             else:
                 shooter = None
                 if nimpulse > cds:
                     dmg = coldmg
-                    print 'Robot', actor1.name, 'collision with', kind2
-                    print '    IMP', nimpulse, 'for', dmg, 'damage',
+                    logger.info('Robot %s collision with %s',
+                                    actor1.name, kind2)
+                    logger.info('    IMP %s for %s damage', nimpulse, dmg)
 
             if dmg:
-                before = actor1.health
-                actor1.health -= dmg
-                if shooter is not None and before > 0:
-                    shooter._damage_caused += dmg
-                actor1.i.health.step(dmg)
-                if actor1.health <= 0:
-                    actor1.alive = False
-                    if shooter is not None and before > 0:
-                        shooter._kills += 1
-                        print '!', shooter.name,
-                    if conf.remove_dead_robots:
-                        if actor1 not in self.w.to_destroy:
-                            self.w.to_destroy.append(actor1)
-                    print
-                else:
-                    print 'down to', actor1.health
-
-        if actor1 in self.w.bullets and not actor1._exploding:
-            if actor1 not in self.w.to_destroy:
-                self.w.to_destroy.append(actor1)
+                self.w.damage(actor1, dmg, shooter)
 
-        if actor2 in self.w.bullets and not actor2._exploding:
-            if actor2 not in self.w.to_destroy:
-                self.w.to_destroy.append(actor2)
+        if kind1 == 'bullet' and not actor1._exploding:
+            self.w.destroy_later(actor1)
 
+        if kind2 == 'bullet' and not actor2._exploding:
+            self.w.destroy_later(actor2)
 
 
 if __name__ == '__main__':